@@ -1,36 +1,59 @@
 # app/main.py
 
 import os
-from fastapi import FastAPI, HTTPException, Depends, Security
+import time
+import asyncio
+import aiohttp
+from fastapi import FastAPI, HTTPException, Depends, Security, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
-from typing import List
+from typing import List, Optional
 # --- MODIFICATION START: Import necessary libraries ---
 from contextlib import asynccontextmanager
-from train_embeddings import chunk_text # Import chunking logic
 # --- MODIFICATION END ---
 
-from app.models.database import get_db, Document, QASession
-from app.models.schemas import QueryRequest, QueryResponse
-from app.services.document_service import DocumentService
-from app.services.embedding_service import EmbeddingService
-from app.services.clause_matcher import ClauseMatcher
-from app.services.qa_service import QAService
-from app.services.db_service import DatabaseService
 from app.config import settings
 from app.utils.helpers import setup_logging, timer, sanitize_text
+from app.utils.thread_budget import apply_thread_budget, budgeted_executor, thread_budget_status
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
+# Before anything imports faiss or torch: OpenMP reads OMP_NUM_THREADS once,
+# when it loads. Also sizes the executors the services create below.
+apply_thread_budget()
+
+from app.models.database import get_db, init_db, close_db  # noqa: E402
+from app.models.schemas import QueryRequest, QueryResponse  # noqa: E402
+from app.services.document_service import DocumentService, DocumentTooLargeError, UnsupportedDocumentError  # noqa: E402
+from app.services.embedding_service import EmbeddingService  # noqa: E402
+from app.services.clause_matcher import ClauseMatcher  # noqa: E402
+from app.services.qa_service import QAService  # noqa: E402
+from app.services.fact_service import FactService  # noqa: E402
+from app.services.db_service import DatabaseService  # noqa: E402
+from app.services.ingestion_service import IngestionService  # noqa: E402
+from app.services.index_snapshot import SnapshotStore, SnapshotValidationError  # noqa: E402
+from app.services.session_writer import SessionWriter  # noqa: E402
+from app.services.admission import AdmissionController, AdmissionRejected  # noqa: E402
+from app.utils.metrics import begin_request, current_timings, render_metrics, REQUEST_DURATION  # noqa: E402
+from app.utils.singleflight import SingleFlight  # noqa: E402
+
+# Corpus PDFs, also readable by name through /hackrx/run
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 # Initialize services (These remain the same)
 document_service = DocumentService()
 embedding_service = EmbeddingService()
 clause_matcher = ClauseMatcher(embedding_service)
-qa_service = QAService(clause_matcher)
+fact_service = FactService()
+qa_service = QAService(clause_matcher, fact_service)
+session_writer = SessionWriter()
+ingestion_service = IngestionService(document_service, embedding_service, fact_service=fact_service)
+# Concurrent requests for the same document share one fetch/parse/embed.
+document_flights = SingleFlight("document")
+admission = AdmissionController([document_service.executor, qa_service.executor])
 
 
 # --- MODIFICATION START: Add a lifespan manager to load data on startup ---
@@ -40,44 +63,42 @@ async def lifespan(app: FastAPI):
     This function runs once when the application starts. It finds all PDF documents,
     processes them, and builds the FAISS vector index (the AI's knowledge base).
     This ensures the data is ready before any questions are received.
+
+    The index is built by one worker only; the others load the saved snapshot
+    (mapped read-only with SERVING_MODE=shared) and follow CURRENT, so a
+    rebuild or rollback handled by one worker reaches all of them.
     """
     logger.info("Application starting up... Initializing the knowledge base.")
+    # asyncio.to_thread runs index builds and shard calls; keep them in the thread budget.
+    asyncio.get_running_loop().set_default_executor(budgeted_executor(thread_name_prefix="default"))
+    await init_db()
+    await session_writer.start()
+    await document_service.start()
     
-    # Define the path to your data directory
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(base_dir, "data")
-    
-    pdf_files = [f for f in os.listdir(data_dir) if f.endswith(".pdf")]
-    
-    if not pdf_files:
-        logger.warning("No PDF files found in app/data/. The Q&A service will have no knowledge.")
+    snapshot_watcher = None
+    if embedding_service.shards is not None:
+        # The corpus is served by the shard processes; only check they answer.
+        for shard in await asyncio.to_thread(embedding_service.shards.refresh):
+            if not shard["healthy"]:
+                logger.warning(f"Index shard {shard['shard']} at {shard['address']} is not answering: {shard['last_error']}")
     else:
-        logger.info(f"Found {len(pdf_files)} documents to process.")
-        all_chunks = []
-        # Process each PDF file
-        for filename in pdf_files:
-            file_path = os.path.join(data_dir, filename)
-            try:
-                text, _ = await document_service.process_document_from_local_path(file_path)
-                if text:
-                    chunks = chunk_text(sanitize_text(text), chunk_size=500, overlap=50)
-                    all_chunks.extend(chunks)
-                    logger.info(f"Processed {filename}, created {len(chunks)} chunks.")
-            except Exception as e:
-                logger.error(f"Failed to process {filename}: {e}")
-
-        # Build the index ONCE with all chunks
-        if all_chunks:
-            logger.info(f"Building FAISS index with {len(all_chunks)} total chunks...")
-            embedding_service.build_index(all_chunks)
-            logger.info("FAISS index built successfully. Application is ready to receive queries.")
-        else:
-            logger.warning("No text chunks were generated. The index remains empty.")
+        await ingestion_service.ensure_index()
+        if settings.SNAPSHOT_POLL_INTERVAL > 0:
+            snapshot_watcher = asyncio.create_task(ingestion_service.watch_snapshots())
+    logger.info(f"Knowledge base ready with {embedding_service.size} chunks (index {embedding_service.version}).")
+    cache_warmer = asyncio.create_task(warm_document_cache())
     
     yield
     # Code below this 'yield' runs on shutdown
     logger.info("Shutting down LLM-Powered Query-Retrieval System")
+    cache_warmer.cancel()
+    if snapshot_watcher is not None:
+        snapshot_watcher.cancel()
+    if embedding_service.shards is not None:
+        embedding_service.shards.close()
     await document_service.close()
+    await session_writer.close()
+    await close_db()
 # --- MODIFICATION END ---
 
 
@@ -97,6 +118,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Bind a request id and per-stage timing breakdown to every request."""
+    request_id = begin_request(request.headers.get("X-Request-ID"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_DURATION.labels(request.method, path, str(status)).observe(time.perf_counter() - start)
+
+
 api_key_header = APIKeyHeader(name="Authorization", auto_error=True)
 def verify_token(authorization: str = Security(api_key_header)):
     if not authorization.startswith("Bearer "):
@@ -106,61 +146,132 @@ def verify_token(authorization: str = Security(api_key_header)):
         raise HTTPException(status_code=401, detail="Invalid API token")
     return token
 
+def verify_admin_token(authorization: str = Security(api_key_header)):
+    if not authorization.startswith("Bearer ") or authorization.split(" ")[1] != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    return authorization.split(" ")[1]
+
 @app.get("/")
 async def root():
     return {"message": "LLM-Powered Query-Retrieval System is running"}
 
 
+async def warm_document_cache() -> None:
+    """
+    Extract the corpus documents into the text cache in the background, so
+    the first request for each one does not parse the PDF. A worker that
+    built the index has them cached already; one that loaded a saved
+    snapshot does not. Goes through document_flights, so a request for a
+    document being warmed waits for that extraction instead of repeating it.
+    """
+    if settings.DOCUMENT_TEXT_CACHE_SIZE <= 0:
+        return
+    try:
+        paths = ingestion_service.list_documents(DATA_DIR)
+    except OSError:
+        return
+    # The last ones in file order: what a build in this worker left in the cache.
+    for path in paths[-settings.DOCUMENT_TEXT_CACHE_SIZE:]:
+        try:
+            await document_flights.do(path, lambda path=path: document_service.process_document_from_local_path(path))
+        except Exception as e:
+            logger.warning(f"Could not pre-extract {os.path.basename(path)}: {e}")
+
+
+def is_remote_document(documents: str) -> bool:
+    return documents.lower().startswith(("http://", "https://"))
+
+
+async def load_remote_document(url: str) -> tuple[str, str]:
+    """
+    Fetch a document by URL and make sure its chunks are searchable. Documents
+    whose content hash is already indexed skip embedding.
+    """
+    text, content_hash = await document_service.process_document(url)
+    if settings.FACT_FAST_PATH and not fact_service.has(content_hash):
+        await document_service.executor.run(fact_service.index_document, content_hash, text)
+    if not embedding_service.is_indexed(content_hash):
+        chunks = document_service.chunk_text(sanitize_text(text), chunk_size=500, overlap=50)
+        embeddings = await document_service.executor.run(embedding_service.create_embeddings, chunks) if chunks else None
+        embedding_service.add_texts(chunks, content_hash, embeddings)
+    return text, content_hash
+
+
 # --- MODIFICATION START: Simplify the main endpoint ---
-@app.post("/hackrx/run", response_model=QueryResponse)
+@app.post("/hackrx/run", response_model=QueryResponse, response_model_exclude_none=True)
 @timer
 async def run_query_retrieval(
     request: QueryRequest,
-    db: Session = Depends(get_db),
+    timings: bool = False,
     token: str = Depends(verify_token)
 ):
     """
     This endpoint now only handles answering questions. It uses the knowledge
     base that was built during startup, making it much faster.
+
+    Pass `?timings=true` to get a per-stage latency breakdown (ms) in the response.
+    When the server is saturated the request is rejected with 429 and Retry-After.
     """
+    filename = request.documents
     try:
-        filename = request.documents
-        logger.info(f"Processing request for file: {filename} with {len(request.questions)} questions")
-
-        if not embedding_service.index or not embedding_service.texts:
-            raise HTTPException(
-                status_code=503, 
-                detail="Knowledge base is not initialized. Check server startup logs."
-            )
-
-        # We still need to read the specific document's content for the LLM's context
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        local_file_path = os.path.join(base_dir, "data", filename)
-        
-        document_content, content_hash = await document_service.process_document_from_local_path(local_file_path)
-        
-        logger.info("Step 1: Answering questions using the pre-built index...")
-        answers = await qa_service.answer_questions(request.questions, document_content)
-
-        logger.info("Step 2: Storing Q&A session")
-        db_service = DatabaseService(db)
-        document_record = db_service.get_or_create_document(
-            blob_url=local_file_path,
+        async with admission.admit(token, len(request.questions)):
+            logger.info("Processing request for file: %s with %d questions", filename, len(request.questions))
+
+            if is_remote_document(filename):
+                document_content, content_hash = await document_flights.do(
+                    filename, lambda: load_remote_document(filename)
+                )
+                blob_url = filename
+            else:
+                if embedding_service.size == 0 and embedding_service.shards is None:
+                    raise HTTPException(
+                        status_code=503, 
+                        detail="Knowledge base is not initialized. Check server startup logs."
+                    )
+
+                # We still need to read the specific document's content for the LLM's context
+                blob_url = os.path.join(DATA_DIR, filename)
+
+                document_content, content_hash = await document_flights.do(
+                    blob_url, lambda: document_service.process_document_from_local_path(blob_url)
+                )
+            
+            logger.info("Step 1: Answering questions using the pre-built index...")
+            answers = await qa_service.answer_questions(request.questions, document_content, content_hash)
+
+        logger.info("Step 2: Queueing Q&A session for storage")
+        await session_writer.submit(
+            blob_url=blob_url,
             content_hash=content_hash,
-            content=sanitize_text(document_content)
-        )
-        qa_session = db_service.create_qa_session(
-            document_id=document_record.id,
+            content=document_content,
             questions=request.questions,
             answers=answers
         )
 
-        logger.info(f"Successfully processed {len(answers)} answers")
-        return QueryResponse(answers=answers)
+        logger.info("Successfully processed %d answers", len(answers))
+        return QueryResponse(answers=answers, timings=current_timings() if timings else None)
 
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except FileNotFoundError:
         logger.error(f"The requested document was not found: {filename}")
         raise HTTPException(status_code=404, detail=f"File not found: {filename}.")
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedDocumentError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except aiohttp.ClientResponseError as e:
+        logger.error(f"Failed to download {filename}: {e.status} {e.message}")
+        raise HTTPException(status_code=502, detail=f"Failed to download document: HTTP {e.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Failed to download {filename}: {e}")
+        raise HTTPException(status_code=502, detail="Failed to download document")
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -170,26 +281,74 @@ async def run_query_retrieval(
 # ... (The rest of your file: /health, /stats, and startup/shutdown events can be removed or simplified) ...
 @app.get("/health")
 async def health_check():
-    return {
+    health = {
         "status": "healthy",
         "embedding_model": settings.EMBEDDING_MODEL,
-        "database_connected": True
+        "database_connected": True,
+        "threads": thread_budget_status(),
     }
+    if embedding_service.shards is not None:
+        shards = await asyncio.to_thread(embedding_service.shards.refresh)
+        health["shards"] = shards
+        if not all(shard["healthy"] for shard in shards):
+            health["status"] = "degraded"
+    return health
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db), token: str = Depends(verify_token)):
+async def get_stats(db: AsyncSession = Depends(get_db), token: str = Depends(verify_token)):
     try:
-        document_count = db.query(Document).count()
-        qa_session_count = db.query(QASession).count()
+        db_service = DatabaseService(db)
+        document_count = await db_service.count_documents()
+        qa_session_count = await db_service.count_qa_sessions()
         return {
             "total_documents": document_count,
             "total_qa_sessions": qa_session_count,
-            "embedding_index_size": len(embedding_service.texts) if embedding_service.texts else 0
+            "embedding_index_size": embedding_service.size,
+            "index_version": embedding_service.version
         }
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get system stats")
 
+@app.get("/admin/index")
+async def index_status(token: str = Depends(verify_admin_token)):
+    return {
+        "active_version": embedding_service.version,
+        "current_version": SnapshotStore.current_version(),
+        "versions": SnapshotStore.versions(),
+        "chunks": len(embedding_service.snapshot),
+        "rebuild": ingestion_service.last_rebuild,
+    }
+
+@app.post("/admin/index/rebuild", status_code=202)
+async def rebuild_index(token: str = Depends(verify_admin_token)):
+    """Build a new index snapshot from app/data in the background and swap it in when it validates."""
+    if embedding_service.shards is not None:
+        raise HTTPException(status_code=409, detail="The index is served by shard processes; restart them to rebuild")
+    if not ingestion_service.start_rebuild():
+        raise HTTPException(status_code=409, detail="An index rebuild is already running")
+    return {"status": "started", "active_version": embedding_service.version}
+
+@app.post("/admin/index/rollback")
+async def rollback_index(version: Optional[str] = None, token: str = Depends(verify_admin_token)):
+    """Reactivate `version`, or the snapshot that was active before the current one."""
+    if embedding_service.shards is not None:
+        raise HTTPException(status_code=409, detail="The index is served by shard processes")
+    if ingestion_service.rebuilding:
+        raise HTTPException(status_code=409, detail="An index rebuild is running")
+    try:
+        active = await ingestion_service.rollback(version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SnapshotValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"active_version": active}
+
 # The old @app.on_event("startup") and @app.on_event("shutdown") are now replaced by the lifespan manager
 
 if __name__ == "__main__":
@@ -2,13 +2,15 @@
 Database models and Pydantic schemas
 """
 
-from .database import Document, QASession, get_db
+from .database import Document, QASession, get_db, init_db, close_db
 from .schemas import QueryRequest, QueryResponse, DocumentMetadata, ClauseMatch
 
 __all__ = [
     "Document",
     "QASession", 
     "get_db",
+    "init_db",
+    "close_db",
     "QueryRequest",
     "QueryResponse",
     "DocumentMetadata",
@@ -1,37 +1,79 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, LargeBinary, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, deferred
 from sqlalchemy.sql import func
 from app.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Sync driver schemes mapped to their asyncio counterparts, so existing
+# DATABASE_URL values keep working unchanged.
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def _engine_options(database_url: str):
+    url = make_url(database_url)
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    options = {}
+    connect_args = {}
+
+    if url.get_backend_name() == "postgresql":
+        # asyncpg does not understand libpq's sslmode query parameter.
+        sslmode = url.query.get("sslmode")
+        if sslmode:
+            url = url.difference_update_query(["sslmode"])
+            connect_args["ssl"] = sslmode
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+        )
+    if connect_args:
+        options["connect_args"] = connect_args
+    return url, options
+
+_url, _options = _engine_options(settings.DATABASE_URL)
+engine = create_async_engine(_url, **_options)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
 Base = declarative_base()
 
 class Document(Base):
     __tablename__ = "documents"
-    
+
     id = Column(Integer, primary_key=True, index=True)
     blob_url = Column(Text, nullable=False)
     content_hash = Column(String(64), unique=True, index=True)
     processed_at = Column(DateTime(timezone=True), server_default=func.now())
-    content = Column(Text)
+    # Both content columns are deferred so loading a Document never pulls the
+    # text; new rows store it zlib-compressed and leave `content` NULL.
+    content = deferred(Column(Text))
+    content_zlib = deferred(Column(LargeBinary))
 
 class QASession(Base):
     __tablename__ = "qa_sessions"
-    
+
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, nullable=False)
     questions = Column(JSON)
     answers = Column(JSON)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+async def init_db():
+    """Create tables. Called from the application lifespan."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if conn.dialect.name == "postgresql":
+            # create_all does not add columns to existing tables.
+            await conn.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_zlib BYTEA"))
+
+async def close_db():
+    await engine.dispose()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
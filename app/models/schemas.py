@@ -1,12 +1,13 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List, Optional
 
 class QueryRequest(BaseModel):
-    documents: str  # Blob URL
+    documents: str  # file name in app/data/ or an http(s) URL
     questions: List[str]
 
 class QueryResponse(BaseModel):
     answers: List[str]
+    timings: Optional[Dict[str, float]] = None  # per-stage ms, only when requested
 
 class DocumentMetadata(BaseModel):
     id: int
@@ -17,4 +18,10 @@ class DocumentMetadata(BaseModel):
 class ClauseMatch(BaseModel):
     content: str
     similarity_score: float
+    source_section: str
+
+class Fact(BaseModel):
+    category: str  # grace_period, waiting_period, limit, premium, exclusion
+    value: Optional[str]  # e.g. "30 days", "Rs. 5,000", "10% of sum insured"; None for exclusions
+    clause: str
     source_section: str
\ No newline at end of file
@@ -6,12 +6,25 @@ from .document_service import DocumentService
 from .embedding_service import EmbeddingService
 from .clause_matcher import ClauseMatcher
 from .qa_service import QAService
+from .fact_service import FactService
 from .db_service import DatabaseService
+from .session_writer import SessionWriter
+from .ingestion_service import IngestionService
+from .admission import AdmissionController, AdmissionRejected
+from .index_snapshot import IndexSnapshot, SnapshotStore, SnapshotWriter
 
 __all__ = [
     "DocumentService",
     "EmbeddingService", 
     "ClauseMatcher",
     "QAService",
-    "DatabaseService"
+    "FactService",
+    "DatabaseService",
+    "SessionWriter",
+    "IngestionService",
+    "AdmissionController",
+    "AdmissionRejected",
+    "IndexSnapshot",
+    "SnapshotStore",
+    "SnapshotWriter"
 ]
\ No newline at end of file
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.config import settings
+from app.utils.executor import TrackedExecutor
+from app.utils.metrics import ADMISSION_REJECTIONS, INFLIGHT_QUESTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Request rejected ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Decides up front whether a /hackrx/run request may start, so that a burst
+    is shed with a 429 instead of queueing until everything times out.
+
+    Work is counted in questions, since each one costs a retrieval and an LLM
+    call. A request is rejected when:
+      - a worker pool already has more than MAX_EXECUTOR_QUEUE calls waiting,
+      - its token would exceed MAX_INFLIGHT_QUESTIONS_PER_TOKEN, or
+      - the process would exceed MAX_INFLIGHT_QUESTIONS. Requests with more than
+        SMALL_REQUEST_QUESTIONS questions may only use the capacity left after
+        SMALL_REQUEST_RESERVE is set aside, so short requests still get in
+        while large ones are being shed.
+    A request larger than a limit on its own is admitted only when nothing
+    else counts against that limit, so it can never be starved outright.
+    """
+
+    def __init__(self, executors: List[TrackedExecutor]):
+        self.executors = executors
+        self.inflight = 0
+        self._requests = 0
+        self._per_token: Dict[str, int] = {}
+        # Moving average of wall time per question, used to size Retry-After.
+        self._seconds_per_question = 2.0
+
+    @staticmethod
+    def _token_id(token: str) -> str:
+        # Key quotas by a digest so raw tokens are not kept around.
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _exceeds(used: int, requested: int, limit: int) -> bool:
+        return used > 0 and used + requested > limit
+
+    def _capacity_for(self, questions: int) -> int:
+        if questions <= settings.SMALL_REQUEST_QUESTIONS:
+            return settings.MAX_INFLIGHT_QUESTIONS
+        return max(1, int(settings.MAX_INFLIGHT_QUESTIONS * (1 - settings.SMALL_REQUEST_RESERVE)))
+
+    def _retry_after(self, excess: int) -> int:
+        # Requests finish in parallel, so roughly `excess / requests` questions
+        # have to complete in each one before there is room.
+        waves = math.ceil(max(1, excess) / max(1, self._requests))
+        seconds = math.ceil(self._seconds_per_question * waves)
+        return min(max(1, seconds), settings.RETRY_AFTER_MAX)
+
+    def _check(self, token_id: str, questions: int) -> Optional[AdmissionRejected]:
+        for executor in self.executors:
+            if executor.queued > settings.MAX_EXECUTOR_QUEUE:
+                return AdmissionRejected(f"{executor.name}_queue", self._retry_after(1))
+
+        used = self._per_token.get(token_id, 0)
+        limit = settings.MAX_INFLIGHT_QUESTIONS_PER_TOKEN
+        if self._exceeds(used, questions, limit):
+            return AdmissionRejected("token_quota", self._retry_after(used + questions - limit))
+
+        limit = self._capacity_for(questions)
+        if self._exceeds(self.inflight, questions, limit):
+            return AdmissionRejected("capacity", self._retry_after(self.inflight + questions - limit))
+        return None
+
+    @asynccontextmanager
+    async def admit(self, token: str, questions: int) -> AsyncIterator[None]:
+        """Hold capacity for `questions` questions, or raise AdmissionRejected."""
+        token_id = self._token_id(token)
+        rejection = self._check(token_id, questions)
+        if rejection is not None:
+            ADMISSION_REJECTIONS.labels(rejection.reason).inc()
+            logger.warning(
+                f"Shedding request with {questions} questions: {rejection.reason} "
+                f"({self.inflight} questions in flight), retry after {rejection.retry_after}s"
+            )
+            raise rejection
+
+        self.inflight += questions
+        self._requests += 1
+        self._per_token[token_id] = self._per_token.get(token_id, 0) + questions
+        INFLIGHT_QUESTIONS.set(self.inflight)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inflight -= questions
+            self._requests -= 1
+            remaining = self._per_token[token_id] - questions
+            if remaining:
+                self._per_token[token_id] = remaining
+            else:
+                del self._per_token[token_id]
+            INFLIGHT_QUESTIONS.set(self.inflight)
+            if questions:
+                elapsed = (time.perf_counter() - start) / questions
+                self._seconds_per_question = 0.8 * self._seconds_per_question + 0.2 * elapsed
@@ -0,0 +1,108 @@
+import mmap
+import os
+from array import array
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped store of chunk texts.
+
+    On disk a store is two files next to the FAISS index:
+      <prefix>.chunks       all chunk texts, UTF-8, concatenated
+      <prefix>.offsets.npy  int64 byte offsets, len(chunks) + 1 entries
+
+    Both are mapped rather than read, so every worker process that opens the
+    same store shares one copy in the page cache instead of unpickling its own
+    list of strings.
+    """
+
+    def __init__(self, data, offsets: np.ndarray, handle=None):
+        self._data = data
+        self._offsets = offsets
+        self._handle = handle
+
+    @staticmethod
+    def paths(prefix: str) -> tuple[str, str]:
+        return f"{prefix}.chunks", f"{prefix}.offsets.npy"
+
+    @classmethod
+    def exists(cls, prefix: str) -> bool:
+        return all(os.path.exists(path) for path in cls.paths(prefix))
+
+    @classmethod
+    def write(cls, prefix: str, texts: List[str]) -> None:
+        """Write texts to disk. Files are written under temporary names and renamed into place."""
+        writer = ChunkWriter(prefix)
+        writer.append(texts)
+        writer.close()
+
+    @classmethod
+    def open(cls, prefix: str) -> "ChunkStore":
+        data_path, offsets_path = cls.paths(prefix)
+        offsets = np.load(offsets_path, mmap_mode="r")
+        if os.path.getsize(data_path) == 0:
+            return cls(b"", offsets)
+        handle = open(data_path, "rb")
+        data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, offsets, handle)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._data[start:end].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._handle is not None:
+            self._handle.close()
+
+
+class ChunkWriter:
+    """
+    Appends texts to a new store as they arrive, so a corpus can be written
+    without holding all of its chunks in memory. Nothing is visible under the
+    store's paths until `close`.
+    """
+
+    def __init__(self, prefix: str):
+        self.data_path, self.offsets_path = ChunkStore.paths(prefix)
+        self._file = open(f"{self.data_path}.tmp", "wb")
+        self._offsets = array("q", [0])
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, texts: Iterable[str]) -> None:
+        position = self._offsets[-1]
+        for text in texts:
+            encoded = text.encode("utf-8")
+            self._file.write(encoded)
+            position += len(encoded)
+            self._offsets.append(position)
+
+    def close(self) -> None:
+        self._file.close()
+        with open(f"{self.offsets_path}.tmp", "wb") as f:
+            np.save(f, np.frombuffer(self._offsets, dtype=np.int64))
+        os.replace(f"{self.data_path}.tmp", self.data_path)
+        os.replace(f"{self.offsets_path}.tmp", self.offsets_path)
+
+    def discard(self) -> None:
+        self._file.close()
+        for path in (self.data_path, self.offsets_path):
+            if os.path.exists(f"{path}.tmp"):
+                os.remove(f"{path}.tmp")
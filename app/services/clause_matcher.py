@@ -3,9 +3,19 @@ import re
 import logging
 from app.services.embedding_service import EmbeddingService
 from app.models.schemas import ClauseMatch
+from app.utils.metrics import stage
 
 logger = logging.getLogger(__name__)
 
+# Common section header patterns
+SECTION_PATTERNS = [
+    r'(?i)section\s+\d+[.:]\s*([^\n]+)',
+    r'(?i)article\s+\d+[.:]\s*([^\n]+)',
+    r'(?i)chapter\s+\d+[.:]\s*([^\n]+)',
+    r'(?i)([A-Z][A-Z\s]+):',
+    r'(?i)(\d+\.\s*[A-Z][^.]+):',
+]
+
 class ClauseMatcher:
     def __init__(self, embedding_service: EmbeddingService):
         self.embedding_service = embedding_service
@@ -23,25 +33,27 @@ class ClauseMatcher:
     def extract_relevant_clauses(self, text: str, query: str) -> List[ClauseMatch]:
         """Extract clauses relevant to the query using semantic search"""
         try:
-            # Split text into sentences/clauses
-            sentences = self._split_into_sentences(text)
-            
-            # Filter sentences that might contain relevant clauses
-            relevant_sentences = self._filter_by_patterns(sentences)
+            with stage("clause.sentence_filter", document_chars=len(text)):
+                # Split text into sentences/clauses
+                sentences = self._split_into_sentences(text)
+                
+                # Filter sentences that might contain relevant clauses
+                relevant_sentences = self._filter_by_patterns(sentences)
             
             # Use embedding search to find most relevant clauses
             search_results = self.embedding_service.search(query, k=10)
             
             # Convert to ClauseMatch objects
             clause_matches = []
-            for content, score in search_results:
-                if score > 0.3:  # Threshold for relevance
-                    clause_match = ClauseMatch(
-                        content=content,
-                        similarity_score=score,
-                        source_section=self._identify_section(content, text)
-                    )
-                    clause_matches.append(clause_match)
+            with stage("clause.section_lookup", clauses=len(search_results), document_chars=len(text)):
+                for content, score in search_results:
+                    if score > 0.3:  # Threshold for relevance
+                        clause_match = ClauseMatch(
+                            content=content,
+                            similarity_score=score,
+                            source_section=self._identify_section(content, text)
+                        )
+                        clause_matches.append(clause_match)
             
             return clause_matches
             
@@ -79,18 +91,9 @@ class ClauseMatcher:
             # Look for section headers before this position
             text_before = full_text[:position]
             
-            # Common section header patterns
-            section_patterns = [
-                r'(?i)section\s+\d+[.:]\s*([^\n]+)',
-                r'(?i)article\s+\d+[.:]\s*([^\n]+)',
-                r'(?i)chapter\s+\d+[.:]\s*([^\n]+)',
-                r'(?i)([A-Z][A-Z\s]+):',
-                r'(?i)(\d+\.\s*[A-Z][^.]+):',
-            ]
-            
             # Find the last section header before the clause
             last_section = "Document"
-            for pattern in section_patterns:
+            for pattern in SECTION_PATTERNS:
                 matches = list(re.finditer(pattern, text_before))
                 if matches:
                     last_match = matches[-1]
@@ -1,84 +1,190 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional
+from typing import Dict, List, Optional
 import logging
 from app.models.database import Document, QASession
+from app.models.schemas import DocumentMetadata
+from app.utils.helpers import compress_text, decompress_text
+from app.utils.metrics import stage
 
 logger = logging.getLogger(__name__)
 
 class DatabaseService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def get_document_by_hash(self, content_hash: str) -> Optional[Document]:
+    def _insert(self, table):
+        """Dialect-specific INSERT so ON CONFLICT is available on both Postgres and SQLite."""
+        if self.db.bind.dialect.name == "sqlite":
+            return sqlite_insert(table)
+        return pg_insert(table)
+
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Document]:
         try:
-            return self.db.query(Document).filter(Document.content_hash == content_hash).first()
+            with stage("db.get_document"):
+                return await self.db.scalar(select(Document).where(Document.content_hash == content_hash))
         except SQLAlchemyError as e:
             logger.error(f"Failed to get document by hash: {e}")
-            self.db.rollback()
+            await self.db.rollback()
             return None
 
-    def create_document(self, blob_url: str, content_hash: str, content: str) -> Document:
+    async def get_document_ref(self, content_hash: str) -> Optional[DocumentMetadata]:
+        """Look up a document's metadata without touching its content columns."""
         try:
-            document = Document(
-                blob_url=blob_url,
-                content_hash=content_hash,
-                content=content
+            with stage("db.get_document_ref"):
+                row = (await self.db.execute(
+                    select(Document.id, Document.blob_url, Document.content_hash, Document.processed_at)
+                    .where(Document.content_hash == content_hash)
+                )).first()
+            if row is None:
+                return None
+            return DocumentMetadata(
+                id=row.id,
+                blob_url=row.blob_url,
+                content_hash=row.content_hash,
+                processed_at=row.processed_at.isoformat() if row.processed_at else ""
+            )
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get document metadata: {e}")
+            await self.db.rollback()
+            return None
+
+    async def get_document_ids(self, content_hashes: List[str]) -> Dict[str, int]:
+        """Map the given content hashes to ids for those already stored."""
+        if not content_hashes:
+            return {}
+        with stage("db.get_document_ids", documents=len(content_hashes)):
+            rows = await self.db.execute(
+                select(Document.content_hash, Document.id).where(Document.content_hash.in_(content_hashes))
             )
-            self.db.add(document)
-            self.db.commit()
-            self.db.refresh(document)
+            return {content_hash: document_id for content_hash, document_id in rows}
+
+    async def get_document_content(self, document_id: int) -> Optional[str]:
+        """Load and decompress a document's text."""
+        try:
+            row = (await self.db.execute(
+                select(Document.content_zlib, Document.content).where(Document.id == document_id)
+            )).first()
+            if row is None:
+                return None
+            if row.content_zlib is not None:
+                return decompress_text(row.content_zlib)
+            return row.content
+        except SQLAlchemyError as e:
+            logger.error(f"Failed to get document content: {e}")
+            await self.db.rollback()
+            return None
+
+    async def create_document(self, blob_url: str, content_hash: str, content: str) -> Document:
+        try:
+            with stage("db.create_document", content_chars=len(content)):
+                document = Document(
+                    blob_url=blob_url,
+                    content_hash=content_hash,
+                    content_zlib=compress_text(content)
+                )
+                self.db.add(document)
+                await self.db.commit()
             return document
         except SQLAlchemyError as e:
             logger.error(f"Failed to create document: {e}")
-            self.db.rollback()
+            await self.db.rollback()
             raise
 
-    def get_or_create_document(self, blob_url: str, content_hash: str, content: str) -> Document:
+    async def upsert_document(self, blob_url: str, content_hash: str, content: str) -> int:
+        """
+        Insert the document unless its content hash is already stored and return its id.
+
+        A single INSERT ... ON CONFLICT (content_hash) DO NOTHING RETURNING id; only
+        when the row already existed is a second lookup needed to fetch the id.
+        """
         try:
-            existing_doc = self.get_document_by_hash(content_hash)
-            if existing_doc:
-                logger.info(f"Using cached document with hash: {content_hash}")
-                return existing_doc
-            logger.info(f"Creating new document with hash: {content_hash}")
-            return self.create_document(blob_url, content_hash, content)
+            with stage("db.upsert_document", content_chars=len(content)):
+                stmt = (
+                    self._insert(Document.__table__)
+                    .values(blob_url=blob_url, content_hash=content_hash, content_zlib=compress_text(content))
+                    .on_conflict_do_nothing(index_elements=[Document.content_hash])
+                    .returning(Document.id)
+                )
+                document_id = await self.db.scalar(stmt)
+                if document_id is None:
+                    document_id = await self.db.scalar(
+                        select(Document.id).where(Document.content_hash == content_hash)
+                    )
+                await self.db.commit()
+            return document_id
         except SQLAlchemyError as e:
-            logger.error(f"Failed to get or create document: {e}")
-            self.db.rollback()
+            logger.error(f"Failed to upsert document: {e}")
+            await self.db.rollback()
             raise
 
-    def create_qa_session(self, document_id: int, questions: List[str], answers: List[str]) -> QASession:
-        try:
-            qa_session = QASession(
-                document_id=document_id,
-                questions=questions,
-                answers=answers
+    async def upsert_documents(self, documents: List[dict]) -> Dict[str, int]:
+        """
+        Multi-row variant of upsert_document. Takes dicts with blob_url,
+        content_hash and content_zlib (already compressed) and returns a
+        content_hash -> id mapping. Does not commit; callers batch it with the
+        rest of their writes.
+        """
+        if not documents:
+            return {}
+        with stage("db.upsert_documents", documents=len(documents)):
+            await self.db.execute(
+                self._insert(Document.__table__)
+                .values(documents)
+                .on_conflict_do_nothing(index_elements=[Document.content_hash])
             )
-            self.db.add(qa_session)
-            self.db.commit()
-            self.db.refresh(qa_session)
+            return await self.get_document_ids([document["content_hash"] for document in documents])
+
+    async def create_qa_sessions(self, sessions: List[dict]) -> None:
+        """Insert many Q&A sessions in a single multi-row INSERT. Does not commit."""
+        if not sessions:
+            return
+        with stage("db.create_qa_sessions", sessions=len(sessions)):
+            await self.db.execute(QASession.__table__.insert().values(sessions))
+
+    async def create_qa_session(self, document_id: int, questions: List[str], answers: List[str]) -> QASession:
+        try:
+            with stage("db.create_qa_session", questions=len(questions)):
+                qa_session = QASession(
+                    document_id=document_id,
+                    questions=questions,
+                    answers=answers
+                )
+                self.db.add(qa_session)
+                await self.db.commit()
             return qa_session
         except SQLAlchemyError as e:
             logger.error(f"Failed to create Q&A session: {e}")
-            self.db.rollback()
+            await self.db.rollback()
             raise
 
-    def get_recent_qa_sessions(self, document_id: int, limit: int = 10) -> List[QASession]:
+    async def get_recent_qa_sessions(self, document_id: int, limit: int = 10) -> List[QASession]:
         try:
-            return (self.db.query(QASession)
-                        .filter(QASession.document_id == document_id)
-                        .order_by(QASession.created_at.desc())
-                        .limit(limit)
-                        .all())
+            result = await self.db.scalars(
+                select(QASession)
+                .where(QASession.document_id == document_id)
+                .order_by(QASession.created_at.desc())
+                .limit(limit)
+            )
+            return list(result)
         except SQLAlchemyError as e:
             logger.error(f"Failed to get recent Q&A sessions: {e}")
-            self.db.rollback()
+            await self.db.rollback()
             return []
 
-    def get_document_by_id(self, document_id: int) -> Optional[Document]:
+    async def get_document_by_id(self, document_id: int) -> Optional[Document]:
         try:
-            return self.db.query(Document).filter(Document.id == document_id).first()
+            return await self.db.get(Document, document_id)
         except SQLAlchemyError as e:
             logger.error(f"Failed to get document by ID: {e}")
-            self.db.rollback()
+            await self.db.rollback()
             return None
+
+    async def count_documents(self) -> int:
+        return await self.db.scalar(select(func.count()).select_from(Document))
+
+    async def count_qa_sessions(self) -> int:
+        return await self.db.scalar(select(func.count()).select_from(QASession))
@@ -1,42 +1,107 @@
 import os
+import asyncio
 import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import IO, Optional, Union
+from urllib.parse import urlparse
 from PyPDF2 import PdfReader
 from docx import Document
 from io import BytesIO
 import logging
 import aiohttp  # For blob URL support
+from app.config import settings
+from app.utils.executor import TrackedExecutor
+from app.utils.metrics import stage
 
 logger = logging.getLogger(__name__)
 
+class DocumentTooLargeError(ValueError):
+    """Raised when a remote document exceeds DOWNLOAD_MAX_BYTES."""
+
+class UnsupportedDocumentError(ValueError):
+    """Raised when a document is neither a PDF nor a DOCX file."""
+
+PDF_CONTENT_TYPES = ("application/pdf",)
+DOCX_CONTENT_TYPES = (
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/msword",
+)
+
 class DocumentService:
     def __init__(self):
-        self.session = aiohttp.ClientSession()
+        # Created in start() so it binds to the serving event loop.
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.executor = TrackedExecutor("extraction", settings.EXTRACTION_WORKERS)
+        # url -> (etag, last_modified, content_hash, kind) for conditional re-fetches
+        self._validators: "OrderedDict[str, tuple]" = OrderedDict()
+        # content_hash -> extracted text, so known documents are never re-extracted
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.HTTP_POOL_LIMIT,
+                limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=settings.HTTP_TIMEOUT,
+                connect=settings.HTTP_CONNECT_TIMEOUT,
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
 
     async def close(self):
-        if not self.session.closed:
+        if self.session is not None and not self.session.closed:
             await self.session.close()
+        self.executor.shutdown(wait=False)
 
-    def _extract_text_from_pdf(self, content: bytes) -> str:
+    def _extract_text_from_pdf(self, content: Union[bytes, IO[bytes]]) -> str:
         try:
-            reader = PdfReader(BytesIO(content))
-            text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
+            reader = PdfReader(BytesIO(content) if isinstance(content, (bytes, bytearray)) else content)
+            pages = (page.extract_text() for page in reader.pages)
+            text = "".join(page_text for page_text in pages if page_text)
             return text.strip()
         except Exception as e:
             logger.error(f"Failed to extract PDF text: {e}")
             raise
 
-    def _extract_text_from_docx(self, content: bytes) -> str:
+    def _extract_text_from_docx(self, content: Union[bytes, IO[bytes]]) -> str:
         try:
-            doc = Document(BytesIO(content))
+            doc = Document(BytesIO(content) if isinstance(content, (bytes, bytearray)) else content)
             text = "\n".join(para.text for para in doc.paragraphs)
             return text.strip()
         except Exception as e:
             logger.error(f"Failed to extract DOCX text: {e}")
             raise
 
+    def _extract_text(self, content: Union[bytes, IO[bytes]], kind: str) -> str:
+        if kind == "pdf":
+            return self._extract_text_from_pdf(content)
+        if kind == "docx":
+            return self._extract_text_from_docx(content)
+        raise UnsupportedDocumentError(f"Unsupported file type: {kind}")
+
+    async def extract_text(self, content: Union[bytes, IO[bytes]], kind: str, size: int = 0) -> str:
+        """Extract text on the extraction pool so parsing never blocks the event loop."""
+        with stage("document.extract", bytes=size):
+            return await self.executor.run(self._extract_text, content, kind)
+
     def get_content_hash(self, content: bytes) -> str:
         return hashlib.sha256(content).hexdigest()
 
+    def get_cached_text(self, content_hash: str) -> Optional[str]:
+        text = self._texts.get(content_hash)
+        if text is not None:
+            self._texts.move_to_end(content_hash)
+        return text
+
+    def cache_text(self, content_hash: str, text: str) -> None:
+        self._texts[content_hash] = text
+        self._texts.move_to_end(content_hash)
+        while len(self._texts) > settings.DOCUMENT_TEXT_CACHE_SIZE:
+            self._texts.popitem(last=False)
+
     def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]:
         words = text.split()
         if not words:
@@ -44,49 +109,152 @@ class DocumentService:
         chunks = [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size - overlap)]
         return chunks
 
+    @staticmethod
+    def _kind_from_name(name: str) -> Optional[str]:
+        name = name.lower()
+        if name.endswith('.pdf'):
+            return "pdf"
+        if name.endswith(('.docx', '.doc')):
+            return "docx"
+        return None
+
+    def _detect_kind(self, url: str, content_type: Optional[str], head: bytes) -> str:
+        """Work out the document type from Content-Type, magic bytes, then the URL path."""
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        if content_type in PDF_CONTENT_TYPES:
+            return "pdf"
+        if content_type in DOCX_CONTENT_TYPES:
+            return "docx"
+        if head.startswith(b"%PDF"):
+            return "pdf"
+        if head.startswith(b"PK\x03\x04"):
+            return "docx"
+        # Ignore query strings such as SAS tokens when falling back to the extension.
+        kind = self._kind_from_name(urlparse(url).path)
+        if kind is None:
+            raise UnsupportedDocumentError(f"Unsupported file type: {url}")
+        return kind
+
+    def _remember_validators(self, url: str, etag: Optional[str], last_modified: Optional[str],
+                             content_hash: str, kind: str) -> None:
+        if not etag and not last_modified:
+            self._validators.pop(url, None)
+            return
+        self._validators[url] = (etag, last_modified, content_hash, kind)
+        self._validators.move_to_end(url)
+        while len(self._validators) > settings.DOCUMENT_TEXT_CACHE_SIZE * 4:
+            self._validators.popitem(last=False)
+
+    async def fetch_document(self, url: str, conditional: bool = True) -> tuple[Optional[IO[bytes]], str, str, int]:
+        """
+        Stream a remote document into a spooled temporary file.
+
+        Returns (file, content_hash, kind, size). The SHA-256 is computed while
+        downloading and the body is capped at DOWNLOAD_MAX_BYTES. When the
+        server answers a conditional request with 304, file is None and the
+        hash of the previously fetched body is returned. Callers close the file.
+        """
+        await self.start()
+        headers = {}
+        cached = self._validators.get(url) if conditional else None
+        if cached:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        with stage("document.download") as span:
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and cached:
+                    span["bytes"] = 0
+                    self._validators.move_to_end(url)
+                    return None, cached[2], cached[3], 0
+                response.raise_for_status()
+
+                max_bytes = settings.DOWNLOAD_MAX_BYTES
+                if response.content_length and response.content_length > max_bytes:
+                    raise DocumentTooLargeError(
+                        f"Document is {response.content_length} bytes; the limit is {max_bytes}"
+                    )
+
+                spool = tempfile.SpooledTemporaryFile(max_size=settings.DOWNLOAD_SPOOL_BYTES)
+                digest = hashlib.sha256()
+                size = 0
+                head = b""
+                try:
+                    async for chunk in response.content.iter_chunked(settings.DOWNLOAD_CHUNK_BYTES):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise DocumentTooLargeError(f"Document exceeds the {max_bytes} byte limit")
+                        if len(head) < 8:
+                            head += chunk[:8]
+                        digest.update(chunk)
+                        spool.write(chunk)
+                    kind = self._detect_kind(url, response.headers.get("Content-Type"), head)
+                except BaseException:
+                    spool.close()
+                    raise
+                span["bytes"] = size
+
+                content_hash = digest.hexdigest()
+                self._remember_validators(
+                    url, response.headers.get("ETag"), response.headers.get("Last-Modified"), content_hash, kind
+                )
+        spool.seek(0)
+        return spool, content_hash, kind, size
+
     async def process_document_from_local_path(self, file_path: str) -> tuple[str, str]:
         logger.info(f"Processing local file: {file_path}")
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found at specified path: {file_path}")
 
         try:
-            with open(file_path, "rb") as f:
-                content_bytes = f.read()
+            with stage("document.read") as span:
+                with open(file_path, "rb") as f:
+                    content_bytes = f.read()
+                span["bytes"] = len(content_bytes)
 
             content_hash = self.get_content_hash(content_bytes)
+            text = self.get_cached_text(content_hash)
+            if text is not None:
+                return text, content_hash
 
-            if file_path.lower().endswith('.pdf'):
-                text = self._extract_text_from_pdf(content_bytes)
-            elif file_path.lower().endswith(('.docx', '.doc')):
-                text = self._extract_text_from_docx(content_bytes)
-            else:
-                raise ValueError(f"Unsupported file type: {file_path}")
-
+            kind = self._kind_from_name(file_path)
+            if kind is None:
+                raise UnsupportedDocumentError(f"Unsupported file type: {file_path}")
+            text = await self.extract_text(content_bytes, kind, len(content_bytes))
+            self.cache_text(content_hash, text)
             return text, content_hash
         except Exception as e:
             logger.error(f"Failed to process local document: {e}")
             raise
 
     async def process_document(self, blob_url: str) -> tuple[str, str]:
+        """
+        Fetch and extract a remote document. Extraction is skipped whenever the
+        downloaded (or 304-confirmed) content hash has already been extracted.
+        """
         logger.info(f"Processing document from URL: {blob_url}")
+        spool = None
         try:
-            async with self.session.get(blob_url) as response:
-                response.raise_for_status()
-                content_bytes = await response.read()
-
-            content_hash = self.get_content_hash(content_bytes)
-
-            if blob_url.lower().endswith('.pdf'):
-                text = self._extract_text_from_pdf(content_bytes)
-            elif blob_url.lower().endswith(('.docx', '.doc')):
-                text = self._extract_text_from_docx(content_bytes)
-            else:
-                raise ValueError(f"Unsupported file type: {blob_url}")
+            spool, content_hash, kind, size = await self.fetch_document(blob_url)
+            text = self.get_cached_text(content_hash)
+            if text is not None:
+                return text, content_hash
 
+            if spool is None:
+                # Not modified, but the text has since been evicted: fetch the body again.
+                spool, content_hash, kind, size = await self.fetch_document(blob_url, conditional=False)
+            text = await self.extract_text(spool, kind, size)
+            self.cache_text(content_hash, text)
             return text, content_hash
         except Exception as e:
             logger.error(f"Failed to process document from URL: {e}")
             raise
+        finally:
+            if spool is not None:
+                spool.close()
 
 def load_pdf_text(file_path: str) -> str:
     """Simple sync wrapper to extract PDF text for training."""
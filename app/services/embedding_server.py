@@ -0,0 +1,144 @@
+"""
+Local embedding server.
+
+Loads the SentenceTransformer once and serves encode requests over a Unix
+socket, so uvicorn workers started with EMBEDDING_SOCKET set share one copy
+of the model weights instead of loading their own.
+
+    python -m app.services.embedding_server --socket /tmp/hackrx-embed.sock
+
+Wire format (all integers big-endian uint32):
+    request:  length, JSON-encoded list of strings
+    response: rows, dim, rows * dim float32 values
+              or rows = 0, dim = 0, length, UTF-8 error message
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import List
+
+import numpy as np
+
+from app.config import settings
+from app.utils.thread_budget import budgeted_executor
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!II")
+LENGTH = struct.Struct("!I")
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        part = sock.recv(size - len(buf))
+        if not part:
+            raise ConnectionError("Embedding server closed the connection")
+        buf.extend(part)
+    return bytes(buf)
+
+
+class RemoteEncoder:
+    """
+    Drop-in for SentenceTransformer.encode backed by the embedding server.
+    Keeps one persistent connection per calling thread.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        payload = json.dumps(list(texts)).encode("utf-8")
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(LENGTH.pack(len(payload)) + payload)
+                rows, dim = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+                if rows == 0 and dim == 0:
+                    (length,) = LENGTH.unpack(_recv_exactly(sock, LENGTH.size))
+                    raise RuntimeError(_recv_exactly(sock, length).decode("utf-8"))
+                data = _recv_exactly(sock, rows * dim * 4)
+                return np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+            except (ConnectionError, OSError):
+                # Stale connection (e.g. server restarted): reconnect once.
+                self._reset()
+                if attempt:
+                    raise
+
+
+class EmbeddingServer:
+    def __init__(self, socket_path: str, model_name: str = settings.EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.socket_path = socket_path
+        self.model = SentenceTransformer(model_name)
+        # One encode at a time; torch already parallelises inside a call.
+        self._lock = asyncio.Lock()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                except asyncio.IncompleteReadError:
+                    break
+                texts = json.loads(await reader.readexactly(length))
+                try:
+                    async with self._lock:
+                        embeddings = await asyncio.to_thread(self.model.encode, texts, convert_to_numpy=True)
+                    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+                    rows, dim = embeddings.shape if len(texts) else (0, 1)
+                    writer.write(HEADER.pack(rows, dim) + embeddings.tobytes())
+                except Exception as e:
+                    logger.error(f"Failed to encode batch of {len(texts)} texts: {e}")
+                    message = str(e).encode("utf-8")
+                    writer.write(HEADER.pack(0, 0) + LENGTH.pack(len(message)) + message)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        # Encodes run through asyncio.to_thread.
+        asyncio.get_running_loop().set_default_executor(budgeted_executor(thread_name_prefix="encode"))
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        logger.info(f"Embedding server listening on {self.socket_path}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve sentence embeddings over a Unix socket.")
+    parser.add_argument("--socket", default=settings.EMBEDDING_SOCKET or "/tmp/hackrx-embed.sock")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL)
+    args = parser.parse_args()
+
+    from app.utils.helpers import setup_logging
+    from app.utils.thread_budget import apply_thread_budget
+    setup_logging()
+    apply_thread_budget(encoders=1)
+    asyncio.run(EmbeddingServer(args.socket, args.model).serve())
@@ -1,126 +1,316 @@
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import pickle
 import os
-from typing import List, Tuple
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
 import logging
 from app.config import settings
+from app.services.index_snapshot import IndexSnapshot, SnapshotStore, SnapshotValidationError, SnapshotWriter
+from app.utils.metrics import stage
 
 logger = logging.getLogger(__name__)
 
+def load_encoder():
+    """The local SentenceTransformer, or a client for the shared embedding server."""
+    if settings.EMBEDDING_SOCKET:
+        from app.services.embedding_server import RemoteEncoder
+        logger.info(f"Using embedding server at {settings.EMBEDDING_SOCKET}")
+        return RemoteEncoder(settings.EMBEDDING_SOCKET)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(settings.EMBEDDING_MODEL)
+
 class EmbeddingService:
-    def __init__(self):
-        self.model = SentenceTransformer(settings.EMBEDDING_MODEL)
-        self.index = None
-        self.texts = []
+    """
+    The corpus index is an immutable IndexSnapshot held behind `snapshot`.
+    Building or activating a version swaps that reference in one step, so
+    searches already running finish on the snapshot they started with. In
+    shared serving mode snapshots are memory-mapped read-only from the files
+    written by the ingesting process. Documents added at runtime go into a
+    small per-process overlay index that is searched alongside it; it keeps
+    the OVERLAY_MAX_DOCUMENTS most recently used documents.
+
+    With INDEX_SHARDS set the corpus lives in shard server processes instead:
+    queries are encoded here and scattered to every shard, and the results
+    are merged with the overlay's.
+    """
+
+    def __init__(self, read_only: bool = settings.SERVING_MODE == "shared"):
+        self.model = load_encoder()
+        self.read_only = read_only
+        self.snapshot = IndexSnapshot()
+        self.overlay_index = None
+        self.overlay_texts = []
+        # content_hash -> (chunks, normalized embeddings), least recently used first
+        self.overlay_documents: "OrderedDict[str, Tuple[List[str], Optional[np.ndarray]]]" = OrderedDict()
+        # Searches run on worker threads; the overlay is the only part that changes under them.
+        self._overlay_lock = threading.Lock()
         self.dimension = 384  # dimension for all-MiniLM-L6-v2
+        self.shards = None
         
         # Ensure data directory exists
-        os.makedirs(os.path.dirname(settings.FAISS_INDEX_PATH), exist_ok=True)
+        os.makedirs(os.path.dirname(settings.FAISS_INDEX_PATH) or ".", exist_ok=True)
         
-        # Load existing index if available
-        self.load_index()
+        if settings.INDEX_SHARDS:
+            from app.services.shard_server import ShardSet
+            self.shards = ShardSet(settings.INDEX_SHARDS)
+        else:
+            # Load existing index if available
+            self.load_index()
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def texts(self):
+        return self.snapshot.texts
+
+    @property
+    def indexed_hashes(self) -> frozenset:
+        """Content hashes of documents whose chunks are in the corpus index (or on a shard)."""
+        if self.shards is not None:
+            return self.shards.content_hashes
+        return self.snapshot.content_hashes
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.snapshot.version
+
+    @property
+    def size(self) -> int:
+        corpus = self.shards.chunks if self.shards is not None else len(self.snapshot)
+        return corpus + len(self.overlay_texts)
     
     def create_embeddings(self, texts: List[str]) -> np.ndarray:
         """Create embeddings for a list of texts"""
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
+            with stage("embedding.encode", texts=len(texts)):
+                embeddings = self.model.encode(texts, convert_to_numpy=True)
             return embeddings.astype('float32')
         except Exception as e:
             logger.error(f"Failed to create embeddings: {e}")
             raise
     
-    def build_index(self, texts: List[str]) -> None:
-        """Build FAISS index from texts"""
+    def build_index(self, texts: List[str], content_hashes: Optional[Iterable[str]] = None,
+                    metadata: Optional[dict] = None) -> str:
+        """
+        Build a new snapshot from texts, validate and save it, then make it the
+        active version. Returns the new version. The active snapshot keeps
+        serving until the swap, and stays active if any step fails.
+        """
+        writer = self.begin_build()
         try:
-            # Create embeddings
-            embeddings = self.create_embeddings(texts)
-            
-            # Initialize FAISS index
-            self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-            
-            # Normalize embeddings for cosine similarity
-            faiss.normalize_L2(embeddings)
-            
-            # Add embeddings to index
-            self.index.add(embeddings)
-            
-            # Store texts for retrieval
-            self.texts = texts
-            
-            # Save index
-            self.save_index()
-            
-            logger.info(f"Built FAISS index with {len(texts)} documents")
-            
+            for start in range(0, len(texts), settings.BUILD_BATCH_SIZE):
+                self.add_to_build(writer, texts[start:start + settings.BUILD_BATCH_SIZE])
+        except Exception as e:
+            writer.discard()
+            logger.error(f"Failed to build index: {e}")
+            raise
+        return self.finish_build(writer, content_hashes, metadata)
+
+    def begin_build(self) -> SnapshotWriter:
+        """Start a snapshot that chunks are streamed into with add_to_build."""
+        return SnapshotWriter(self.dimension)
+
+    def add_to_build(self, writer: SnapshotWriter, texts: List[str]) -> None:
+        """Encode one batch of chunks and append it to the snapshot being built."""
+        embeddings = self.create_embeddings(texts)
+        # Normalize embeddings for cosine similarity
+        faiss.normalize_L2(embeddings)
+        writer.add(texts, embeddings)
+
+    def finish_build(self, writer: SnapshotWriter, content_hashes: Optional[Iterable[str]] = None,
+                     metadata: Optional[dict] = None) -> str:
+        """Validate and save a streamed snapshot, then make it the active version."""
+        try:
+            content_hashes = sorted(set(content_hashes or ()))
+            manifest = dict(metadata or {})
+            manifest.update({
+                "previous": self.version,
+                "created_at": time.time(),
+                "count": len(writer),
+                "dimension": self.dimension,
+                "model": settings.EMBEDDING_MODEL,
+                "content_hashes": content_hashes,
+            })
+            snapshot = writer.finish(content_hashes, manifest)
+            self.validate(snapshot)
+            writer.commit(snapshot)
+
+            # Serve what was saved: mapped read-only in shared mode, loaded into memory otherwise.
+            snapshot = SnapshotStore.load(writer.version, self.read_only)
+            SnapshotStore.set_current(snapshot.version)
+            self.swap(snapshot)
+            SnapshotStore.prune(settings.SNAPSHOT_RETAIN)
+
+            logger.info(f"Built FAISS index with {len(snapshot)} documents")
+            return snapshot.version
+
         except Exception as e:
+            writer.discard()
             logger.error(f"Failed to build index: {e}")
             raise
+
+    def validate(self, snapshot: IndexSnapshot) -> None:
+        """Raise SnapshotValidationError unless the snapshot is safe to serve."""
+        count = snapshot.manifest.get("count", len(snapshot))
+        if snapshot.index is None or snapshot.index.ntotal != len(snapshot) or count != len(snapshot):
+            raise SnapshotValidationError(f"Snapshot {snapshot.version} index and chunk counts do not match")
+        if snapshot.index.d != self.dimension:
+            raise SnapshotValidationError(f"Snapshot {snapshot.version} has dimension {snapshot.index.d}, expected {self.dimension}")
+        if snapshot.manifest.get("model", settings.EMBEDDING_MODEL) != settings.EMBEDDING_MODEL:
+            raise SnapshotValidationError(f"Snapshot {snapshot.version} was built with {snapshot.manifest['model']}")
+        if not len(snapshot):
+            return
+        # A few chunks must find themselves, which catches texts out of step with vectors.
+        probes = sorted({0, len(snapshot) // 2, len(snapshot) - 1})
+        queries = self.create_embeddings([snapshot.texts[i] for i in probes])
+        faiss.normalize_L2(queries)
+        scores, _ = snapshot.index.search(queries, 1)
+        if float(scores.min()) < 0.99:
+            raise SnapshotValidationError(f"Snapshot {snapshot.version} failed the self-retrieval check")
+
+    def swap(self, snapshot: IndexSnapshot) -> None:
+        """Make `snapshot` the one new searches use."""
+        with self._overlay_lock:
+            self.snapshot = snapshot
+            self._drop_from_overlay(snapshot.content_hashes)
+        logger.info(f"Serving index snapshot {snapshot.version} with {len(snapshot)} chunks")
+
+    def activate(self, version: str, persist: bool = True) -> None:
+        """
+        Load a saved version, validate it and swap it in. With persist the
+        version also becomes CURRENT on disk (e.g. a rollback), so other workers
+        and later restarts follow it.
+        """
+        snapshot = SnapshotStore.load(version, self.read_only)
+        self.validate(snapshot)
+        if persist:
+            SnapshotStore.set_current(version)
+        self.swap(snapshot)
     
+    def is_indexed(self, content_hash: str) -> bool:
+        """Whether the document's chunks are searchable; marks an overlay document as recently used."""
+        if content_hash in self.indexed_hashes:
+            return True
+        with self._overlay_lock:
+            if content_hash in self.overlay_documents:
+                self.overlay_documents.move_to_end(content_hash)
+                return True
+        return False
+
+    def add_texts(self, texts: List[str], content_hash: str, embeddings: Optional[np.ndarray] = None) -> None:
+        """
+        Add one document's chunks to the overlay index. Pass embeddings computed
+        off the event loop (create_embeddings) to keep this call cheap. The
+        least recently used documents beyond OVERLAY_MAX_DOCUMENTS are evicted.
+        """
+        if self.is_indexed(content_hash):
+            return
+        try:
+            if embeddings is None and texts:
+                embeddings = self.create_embeddings(texts)
+            if embeddings is not None:
+                faiss.normalize_L2(embeddings)
+            with self._overlay_lock:
+                self.overlay_documents[content_hash] = (list(texts), embeddings)
+                evicted = 0
+                while len(self.overlay_documents) > max(1, settings.OVERLAY_MAX_DOCUMENTS):
+                    self.overlay_documents.popitem(last=False)
+                    evicted += 1
+                if evicted:
+                    self._rebuild_overlay()
+                elif embeddings is not None:
+                    if self.overlay_index is None:
+                        self.overlay_index = faiss.IndexFlatIP(self.dimension)
+                    self.overlay_texts.extend(texts)
+                    self.overlay_index.add(embeddings)
+            logger.info(f"Added {len(texts)} chunks for document {content_hash} to the index")
+        except Exception as e:
+            logger.error(f"Failed to add texts to index: {e}")
+            raise
+
+    def _drop_from_overlay(self, content_hashes: frozenset) -> None:
+        """Evict overlay documents the corpus now serves; call with _overlay_lock held."""
+        stale = [h for h in self.overlay_documents if h in content_hashes]
+        for content_hash in stale:
+            del self.overlay_documents[content_hash]
+        if stale:
+            self._rebuild_overlay()
+
+    def _rebuild_overlay(self) -> None:
+        """Re-create the overlay index from the documents it keeps; call with _overlay_lock held."""
+        index = faiss.IndexFlatIP(self.dimension)
+        texts = []
+        for chunks, embeddings in self.overlay_documents.values():
+            if embeddings is not None:
+                index.add(embeddings)
+                texts.extend(chunks)
+        self.overlay_index, self.overlay_texts = index, texts
+
     def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
         """Search for similar texts"""
         try:
-            if self.index is None or len(self.texts) == 0:
+            # Shards that have not answered yet count no chunks, but the search reaches them.
+            if self.size == 0 and self.shards is None:
                 return []
             
             # Create query embedding
             query_embedding = self.create_embeddings([query])
             faiss.normalize_L2(query_embedding)
             
-            # Search
-            scores, indices = self.index.search(query_embedding, min(k, len(self.texts)))
-            
-            # Return results
-            results = []
-            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-                if idx >= 0:  # Valid index
-                    results.append((self.texts[idx], float(score)))
+            # Search the corpus and the overlay, then merge by score
+            snapshot = self.snapshot
+            with stage("embedding.search", chunks_searched=self.size, k=k):
+                if self.shards is not None:
+                    results = self.shards.search(query_embedding, k)
+                else:
+                    results = snapshot.search(query_embedding, k)
+                with self._overlay_lock:
+                    if self.shards is not None:
+                        # Shards learn about documents after they were added here.
+                        self._drop_from_overlay(self.shards.content_hashes)
+                    results.extend(self._search_overlay(query_embedding, k))
             
-            return results
+            results.sort(key=lambda item: item[1], reverse=True)
+            return results[:k]
             
         except Exception as e:
             logger.error(f"Failed to search: {e}")
             raise
     
-    def save_index(self) -> None:
-        """Save FAISS index and texts to disk"""
-        try:
-            if self.index is None:
-                return
-                
-            # Save FAISS index
-            faiss.write_index(self.index, f"{settings.FAISS_INDEX_PATH}.index")
-            
-            # Save texts
-            with open(f"{settings.FAISS_INDEX_PATH}.texts", 'wb') as f:
-                pickle.dump(self.texts, f)
-                
-            logger.info("Saved FAISS index to disk")
-            
-        except Exception as e:
-            logger.error(f"Failed to save index: {e}")
+    def _search_overlay(self, query_embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if self.overlay_index is None or not self.overlay_texts:
+            return []
+        scores, indices = self.overlay_index.search(query_embedding, min(k, len(self.overlay_texts)))
+        return [(self.overlay_texts[idx], float(score)) for score, idx in zip(scores[0], indices[0]) if idx >= 0]
+
+    @staticmethod
+    def read_metadata() -> Optional[dict]:
+        """Manifest of the version that is CURRENT on disk, if any."""
+        version = SnapshotStore.current_version()
+        return SnapshotStore.read_manifest(version) if version else None
     
     def load_index(self) -> None:
-        """Load FAISS index and texts from disk"""
+        """
+        Load the CURRENT snapshot from disk. In read-only mode index and texts
+        are memory-mapped so worker processes share them through the page cache.
+        """
         try:
-            index_path = f"{settings.FAISS_INDEX_PATH}.index"
-            texts_path = f"{settings.FAISS_INDEX_PATH}.texts"
-            
-            if os.path.exists(index_path) and os.path.exists(texts_path):
-                # Load FAISS index
-                self.index = faiss.read_index(index_path)
-                
-                # Load texts
-                with open(texts_path, 'rb') as f:
-                    self.texts = pickle.load(f)
-                
-                logger.info(f"Loaded FAISS index with {len(self.texts)} documents")
+            version = SnapshotStore.current_version()
+            if version:
+                self.swap(SnapshotStore.load(version, self.read_only))
+                return
+            # Index saved before versioned snapshots existed
+            snapshot = SnapshotStore.load_legacy()
+            if snapshot is not None:
+                self.swap(snapshot)
             else:
                 logger.info("No existing FAISS index found")
                 
         except Exception as e:
             logger.error(f"Failed to load index: {e}")
             # Initialize empty index on failure
-            self.index = None
-            self.texts = []
\ No newline at end of file
+            self.swap(IndexSnapshot())
@@ -0,0 +1,258 @@
+import bisect
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.models.schemas import Fact
+from app.services.clause_matcher import SECTION_PATTERNS
+from app.utils.metrics import FACT_ANSWERS, stage
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = (
+    r"(?:\d+(?:\.\d+)?|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|"
+    r"fifteen|eighteen|twenty[- ]four|twenty|thirty[- ]six|thirty|forty[- ]eight|forty[- ]five|forty|sixty|ninety)"
+)
+DURATION = re.compile(rf"\b{_NUMBER}(?:\s*\(\s*\d+\s*\))?\s*(?:consecutive\s+)?(?:days?|months?|years?)\b", re.I)
+MONEY = re.compile(r"(?:Rs\.?|INR|₹)\s?\d[\d,]*(?:\.\d+)?(?:\s?(?:lakhs?|crores?))?", re.I)
+AMOUNT = re.compile(
+    rf"{MONEY.pattern}"
+    r"|\b\d+(?:\.\d+)?\s?%(?:\s+of\s+(?:the\s+)?(?:annual\s+|base\s+)?sum\s+insured)?",
+    re.I,
+)
+
+# category -> (clause trigger, value pattern or None)
+FACT_PATTERNS: Dict[str, Tuple[re.Pattern, Optional[re.Pattern]]] = {
+    "grace_period": (re.compile(r"\bgrace period\b", re.I), DURATION),
+    # Standard IRDAI exclusion wording: "excluded until the expiry of 36 months of continuous coverage".
+    "waiting_period": (re.compile(r"\bwaiting period\b|\buntil the expiry of\b", re.I), DURATION),
+    "limit": (re.compile(r"\b(?:sub-?limit|limit(?:ed)? to|maximum|up ?to|capped)\b", re.I), AMOUNT),
+    "premium": (re.compile(r"\bpremium\b", re.I), AMOUNT),
+    # Sentences only: a bare "Not Covered" is usually a cell of a plan comparison table.
+    "exclusion": (re.compile(r"\b(?:(?:is|are|be)\s+(?:excluded|not covered|not payable)|shall not be liable)\b", re.I), None),
+}
+
+ANSWER_TEMPLATES = {
+    "grace_period": "The grace period is {value}.",
+    "waiting_period": "The waiting period is {value}.",
+    "limit": "The limit is {value}.",
+    "premium": "The policy specifies {value} for this premium.",
+    "exclusion": "This is excluded under the policy.",
+}
+
+# The trigger must be this close to the value (or, for exclusions, to the
+# question's subject) for the clause to be about it: "Grace Period of 30 days",
+# not a grace period mentioned somewhere in a clause about something else.
+PROXIMITY_CHARS = 60
+
+# Lead-ins to a list of carve-outs ("Specific Exclusions Applicable to Dental
+# Treatment"): the subject they name is covered, with exceptions.
+_EXCLUSION_LIST = re.compile(r"\bexclusions?\s+(?:applicable|apply)\b|\bthe following\b|:\s", re.I)
+# A percentage next to "premium" is usually an adjustment to it, not the premium.
+_PREMIUM_ADJUSTMENT = re.compile(r"\b(?:discount|loading|refund|rebate|cashback)\b", re.I)
+
+# "maximum"/"minimum" in a question asks for a limit only when it qualifies money.
+_MONEY_LIMIT = re.compile(
+    r"\b(?:maximum|minimum)\s+(?:amount|sum insured|limit|cost|expenses?|payable|payout|rs\.?|inr|rupees)\b", re.I
+)
+_MONEY_SUBJECT = re.compile(r"\b(?:sum insured|amount|rupees|rs\.?|inr|cost)\b", re.I)
+
+# Sentence ends and the "a)", "ii)" markers of enumerated sub-clauses.
+_CLAUSE_BREAK = re.compile(r"(?<=[.!?;])\s+(?=[A-Z(\d])|\s+(?=\(?(?:[a-h]|[ivx]{1,4})\)\s)")
+# Longer "clauses" are almost always tables flattened by the PDF extractor.
+MAX_CLAUSE_CHARS = 500
+
+
+def _stem(word: str) -> str:
+    if len(word) > 3 and word.endswith("s"):
+        word = word[:-1]
+    for suffix in ("ment", "ing", "ed"):
+        if len(word) - len(suffix) >= 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _words(text: str) -> set:
+    return {_stem(word) for word in re.findall(r"[a-z0-9]+", text.lower())}
+
+
+# Words that carry no subject: question words, the category's own vocabulary and policy boilerplate.
+# Payment words are listed because every premium clause has them; as a subject
+# they would pick the instalment grace period over the renewal one.
+_IGNORED_WORDS = {_stem(word) for word in {
+    "what", "which", "when", "how", "much", "many", "long", "is", "are", "was", "the", "a", "an", "of",
+    "for", "to", "in", "on", "under", "this", "that", "there", "any", "does", "do", "policy", "plan",
+    "insurance", "insured", "and", "or", "by", "with", "it", "its", "be", "will", "can", "my", "i",
+    "grace", "waiting", "period", "limit", "limits", "maximum", "minimum", "amount", "cost", "premium",
+    "excluded", "exclude", "exclusion", "covered", "cover", "coverage", "not", "time", "duration",
+    "pay", "paid", "payment", "payable", "due", "applicable", "apply",
+}}
+
+
+def _near(first: Tuple[int, int], second: Tuple[int, int]) -> bool:
+    return max(first[0] - second[1], second[0] - first[1]) <= PROXIMITY_CHARS
+
+
+class FactService:
+    """
+    Structured facts (grace and waiting periods, limits, premiums, exclusions)
+    extracted from each document once, with the clause and section they came
+    from, and a fast path that answers a question from them without the LLM.
+
+    Facts are indexed by document content hash and category, and kept for the
+    FACT_CACHE_DOCUMENTS most recently used documents. A question is answered
+    from facts only when its category is clear, the best facts cover all of
+    its subject words well enough (FACT_MIN_CONFIDENCE) and they agree on one
+    value; anything else goes to the LLM.
+    """
+
+    def __init__(self):
+        self._facts: "OrderedDict[str, Dict[str, List[Fact]]]" = OrderedDict()
+        # Written from ingestion threads, read from retrieval threads.
+        self._lock = threading.Lock()
+
+    def has(self, content_hash: str) -> bool:
+        """Whether the document's facts are stored; marks them as recently used."""
+        with self._lock:
+            if content_hash not in self._facts:
+                return False
+            self._facts.move_to_end(content_hash)
+            return True
+
+    def facts(self, content_hash: str, category: Optional[str] = None) -> List[Fact]:
+        with self._lock:
+            if content_hash not in self._facts:
+                return []
+            self._facts.move_to_end(content_hash)
+            by_category = self._facts[content_hash]
+            if category is not None:
+                return list(by_category.get(category, ()))
+            return [fact for facts in by_category.values() for fact in facts]
+
+    @staticmethod
+    def _section_index(text: str) -> Tuple[List[int], List[str]]:
+        headers = []
+        for pattern in SECTION_PATTERNS:
+            headers.extend((m.start(), " ".join(m.group(1).split())) for m in re.finditer(pattern, text))
+        headers.sort()
+        return [position for position, _ in headers], [name for _, name in headers]
+
+    @staticmethod
+    def extract(text: str) -> Dict[str, List[Fact]]:
+        """Category -> facts found in the document text."""
+        positions, names = FactService._section_index(text)
+        extracted: Dict[str, List[Fact]] = {}
+        start = 0
+        for match in _CLAUSE_BREAK.finditer(text + " A"):
+            sentence, offset = text[start:match.start()], start
+            start = match.end()
+            clause = " ".join(sentence.split())
+            if not 20 <= len(clause) <= MAX_CLAUSE_CHARS:
+                continue
+            for category, (trigger, value_pattern) in FACT_PATTERNS.items():
+                triggers = [m.span() for m in trigger.finditer(clause)]
+                if not triggers:
+                    continue
+                value = None
+                if value_pattern is None:
+                    # An exclusion with a period or amount is conditional ("until the expiry of
+                    # 24 months", a plan table row), not a plain "this is excluded".
+                    if _EXCLUSION_LIST.search(clause) or DURATION.search(clause) or AMOUNT.search(clause):
+                        continue
+                else:
+                    found = list(value_pattern.finditer(clause))
+                    # A clause with several values ("Monthly 15 days ... Yearly 30 days") is a table, not a fact.
+                    if len({" ".join(m.group(0).lower().split()) for m in found}) != 1:
+                        continue
+                    if not any(_near(m.span(), span) for m in found for span in triggers):
+                        continue
+                    if category == "premium" and _PREMIUM_ADJUSTMENT.search(clause):
+                        continue
+                    value = " ".join(found[0].group(0).split())
+                i = bisect.bisect_right(positions, offset) - 1
+                section = names[i] if i >= 0 else "Document"
+                extracted.setdefault(category, []).append(
+                    Fact(category=category, value=value, clause=clause, source_section=section)
+                )
+        return extracted
+
+    def index_document(self, content_hash: str, text: str) -> int:
+        """Extract and store a document's facts. Returns how many were found."""
+        if self.has(content_hash):
+            return len(self.facts(content_hash))
+        with stage("facts.extract", document_chars=len(text)):
+            extracted = self.extract(text)
+        with self._lock:
+            self._facts[content_hash] = extracted
+            while len(self._facts) > settings.FACT_CACHE_DOCUMENTS:
+                self._facts.popitem(last=False)
+        count = sum(len(facts) for facts in extracted.values())
+        logger.info(f"Extracted {count} facts from document {content_hash}")
+        return count
+
+    @staticmethod
+    def categorize(question: str, key_information: dict) -> Optional[str]:
+        """Map the keyword categories of a question to one fact category."""
+        time_terms = set(key_information.get("time_terms", ()))
+        if "grace" in time_terms:
+            return "grace_period"
+        if "waiting" in time_terms:
+            return "waiting_period"
+        if key_information.get("exclusion_terms"):
+            return "exclusion"
+        amount_terms = set(key_information.get("amount_terms", ()))
+        if "premium" in amount_terms and not amount_terms - {"premium"}:
+            return "premium"
+        if "limit" in amount_terms or _MONEY_LIMIT.search(question):
+            return "limit"
+        return None
+
+    @staticmethod
+    def _applies(fact: Fact, question: str, subject: set) -> bool:
+        """Category-specific checks that the fact answers this question, beyond word overlap."""
+        if fact.category == "limit" and _MONEY_SUBJECT.search(question):
+            # "maximum sum insured" wants a rupee amount, not "100% of sum insured".
+            return bool(MONEY.fullmatch(fact.value or ""))
+        if fact.category == "exclusion":
+            # The subject must be what the exclusion is about, not just mentioned in the clause.
+            trigger = FACT_PATTERNS["exclusion"][0]
+            triggers = [m.span() for m in trigger.finditer(fact.clause)]
+            words = [m for m in re.finditer(r"[a-z0-9]+", fact.clause.lower()) if _stem(m.group(0)) in subject]
+            return any(_near(m.span(), span) for m in words for span in triggers)
+        return True
+
+    def answer(self, question: str, content_hash: str, key_information: dict) -> Optional[str]:
+        """A cited answer from the document's facts, or None if the LLM should answer."""
+        category = self.categorize(question, key_information)
+        if category is None or not self.has(content_hash):
+            FACT_ANSWERS.labels("no_category" if category is None else "not_indexed").inc()
+            return None
+
+        subject = _words(question) - _IGNORED_WORDS
+        if category in ("exclusion", "limit", "premium") and not subject:
+            FACT_ANSWERS.labels("low_confidence").inc()
+            return None
+
+        facts = self.facts(content_hash, category)
+        if not facts:
+            FACT_ANSWERS.labels("no_fact").inc()
+            return None
+
+        # Every fact that matches the question well enough must give the same answer.
+        scored = []
+        for fact in facts:
+            score = len(subject & _words(fact.clause)) / len(subject) if subject else 1.0
+            if score >= settings.FACT_MIN_CONFIDENCE:
+                scored.append((score, fact))
+        values = {fact.value.lower() if fact.value else None for _, fact in scored}
+        if not scored or len(values) != 1 or not all(self._applies(fact, question, subject) for _, fact in scored):
+            FACT_ANSWERS.labels("low_confidence").inc()
+            return None
+
+        fact = max(scored, key=lambda item: item[0])[1]
+        FACT_ANSWERS.labels("answered").inc()
+        summary = ANSWER_TEMPLATES[category].format(value=fact.value)
+        return f'{summary} Source ({fact.source_section}): "{fact.clause}"'
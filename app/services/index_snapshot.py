@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.services.chunk_store import ChunkStore, ChunkWriter
+
+logger = logging.getLogger(__name__)
+
+# Zero-copy mapping of flat index codes; older FAISS builds only have IO_FLAG_MMAP.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class SnapshotValidationError(ValueError):
+    pass
+
+
+class IndexSnapshot:
+    """
+    One immutable version of the corpus index: the FAISS index, the chunk
+    texts and the manifest describing them. Snapshots are never modified after
+    they are built or loaded; a rebuild produces a new one that replaces the
+    old reference, so a search that already holds a snapshot finishes on it.
+    """
+
+    def __init__(self, index=None, texts=None, content_hashes: Iterable[str] = (), manifest: Optional[dict] = None):
+        self.index = index
+        self.texts = texts if texts is not None else []
+        self.content_hashes = frozenset(content_hashes)
+        self.manifest = manifest or {}
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.manifest.get("version")
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(self, query_embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if self.index is None or len(self.texts) == 0:
+            return []
+        scores, indices = self.index.search(query_embedding, min(k, len(self.texts)))
+        return [(self.texts[idx], float(score)) for score, idx in zip(scores[0], indices[0]) if idx >= 0]
+
+
+class SnapshotStore:
+    """
+    Versioned snapshots on disk, next to FAISS_INDEX_PATH:
+
+      <prefix>.snapshots/<version>/corpus.index
+      <prefix>.snapshots/<version>/corpus.chunks, corpus.offsets.npy
+      <prefix>.snapshots/<version>/manifest.json
+      <prefix>.snapshots/CURRENT      name of the active version
+
+    A snapshot is written to a temporary directory and renamed into place, and
+    CURRENT is replaced atomically, so readers never see a partial version.
+    """
+
+    MANIFEST = "manifest.json"
+    CURRENT = "CURRENT"
+
+    @staticmethod
+    def root() -> str:
+        return f"{settings.FAISS_INDEX_PATH}.snapshots"
+
+    @classmethod
+    def path(cls, version: str) -> str:
+        return os.path.join(cls.root(), version)
+
+    @staticmethod
+    def new_version() -> str:
+        # Sorts by creation time; the suffix keeps concurrent builders apart.
+        return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+
+    @classmethod
+    def versions(cls) -> List[str]:
+        """Complete versions on disk, oldest first."""
+        try:
+            names = os.listdir(cls.root())
+        except FileNotFoundError:
+            return []
+        return sorted(
+            name for name in names
+            if not name.startswith(".") and os.path.exists(os.path.join(cls.root(), name, cls.MANIFEST))
+        )
+
+    @classmethod
+    def current_version(cls) -> Optional[str]:
+        try:
+            with open(os.path.join(cls.root(), cls.CURRENT)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    @classmethod
+    def set_current(cls, version: str) -> None:
+        path = os.path.join(cls.root(), cls.CURRENT)
+        with open(f"{path}.tmp", "w") as f:
+            f.write(version)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def read_manifest(cls, version: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(cls.path(version), cls.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def staging_path(cls, version: str) -> str:
+        return os.path.join(cls.root(), f".{version}.tmp")
+
+    @classmethod
+    def save(cls, snapshot: IndexSnapshot) -> None:
+        tmp_dir = cls.staging_path(snapshot.version)
+        os.makedirs(tmp_dir)
+        try:
+            ChunkStore.write(os.path.join(tmp_dir, "corpus"), list(snapshot.texts))
+            cls.commit(snapshot)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def commit(cls, snapshot: IndexSnapshot) -> None:
+        """Write the index and manifest next to the staged chunks and move the version into place."""
+        version = snapshot.version
+        tmp_dir = cls.staging_path(version)
+        faiss.write_index(snapshot.index, os.path.join(tmp_dir, "corpus.index"))
+        with open(os.path.join(tmp_dir, cls.MANIFEST), "w") as f:
+            json.dump(snapshot.manifest, f)
+        os.rename(tmp_dir, cls.path(version))
+        logger.info(f"Saved index snapshot {version} with {len(snapshot)} chunks")
+
+    @classmethod
+    def load(cls, version: str, read_only: bool) -> IndexSnapshot:
+        """Open a saved version. In read-only mode index and texts are memory-mapped."""
+        manifest = cls.read_manifest(version)
+        if manifest is None:
+            raise FileNotFoundError(f"Index snapshot {version} not found")
+        prefix = os.path.join(cls.path(version), "corpus")
+        index = faiss.read_index(f"{prefix}.index", MMAP_FLAGS) if read_only else faiss.read_index(f"{prefix}.index")
+        texts = ChunkStore.open(prefix)
+        if not read_only:
+            texts = list(texts)
+        return IndexSnapshot(index, texts, manifest.get("content_hashes", ()), manifest)
+
+    @staticmethod
+    def load_legacy() -> Optional[IndexSnapshot]:
+        """Index files saved before versioned snapshots existed, if any."""
+        prefix = settings.FAISS_INDEX_PATH
+        index_path = f"{prefix}.index"
+        if not os.path.exists(index_path):
+            return None
+        manifest = {"version": "legacy"}
+        if os.path.exists(f"{prefix}.meta.json") and ChunkStore.exists(prefix):
+            with open(f"{prefix}.meta.json") as f:
+                manifest.update(json.load(f))
+            texts = list(ChunkStore.open(prefix))
+        elif os.path.exists(f"{prefix}.texts"):
+            with open(f"{prefix}.texts", "rb") as f:
+                texts = pickle.load(f)
+        else:
+            return None
+        return IndexSnapshot(faiss.read_index(index_path), texts, manifest.get("content_hashes", ()), manifest)
+
+    @classmethod
+    def prune(cls, keep: int) -> None:
+        """Delete all but the newest `keep` versions, never the active one."""
+        current = cls.current_version()
+        versions = cls.versions()
+        for version in versions[:max(0, len(versions) - keep)]:
+            if version != current:
+                # Workers that still map these files keep them alive until they let go.
+                shutil.rmtree(cls.path(version), ignore_errors=True)
+                logger.info(f"Removed old index snapshot {version}")
+
+
+class SnapshotWriter:
+    """
+    Builds a new snapshot batch by batch, so a corpus can be indexed without
+    holding all of its chunks (or all of its embeddings) at once: vectors go
+    straight into the FAISS index and chunk texts into the chunk store in the
+    version's staging directory. `finish` opens the staged snapshot for
+    validation and `commit` moves it into place; `discard` drops it.
+    """
+
+    def __init__(self, dimension: int):
+        self.version = SnapshotStore.new_version()
+        self.prefix = os.path.join(SnapshotStore.staging_path(self.version), "corpus")
+        os.makedirs(os.path.dirname(self.prefix))
+        self.index = faiss.IndexFlatIP(dimension)
+        self.chunks = ChunkWriter(self.prefix)
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def add(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """Append chunks and their (normalized) embeddings, in the same order."""
+        if len(texts) != len(embeddings):
+            raise ValueError(f"{len(texts)} chunks but {len(embeddings)} embeddings")
+        self.index.add(embeddings)
+        self.chunks.append(texts)
+
+    def finish(self, content_hashes: Iterable[str], manifest: dict) -> IndexSnapshot:
+        self.chunks.close()
+        manifest = dict(manifest, version=self.version)
+        return IndexSnapshot(self.index, ChunkStore.open(self.prefix), content_hashes, manifest)
+
+    def commit(self, snapshot: IndexSnapshot) -> None:
+        snapshot.texts.close()
+        SnapshotStore.commit(snapshot)
+        self.index = None
+
+    def discard(self) -> None:
+        self.chunks.discard()
+        shutil.rmtree(os.path.dirname(self.prefix), ignore_errors=True)
+        self.index = None
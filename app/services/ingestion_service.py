@@ -0,0 +1,317 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import resource
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from app.config import settings
+from app.services.document_service import DocumentService
+from app.services.embedding_service import EmbeddingService
+from app.services.fact_service import FactService
+from app.services.index_snapshot import SnapshotStore
+from app.utils.helpers import sanitize_text
+from app.utils.thread_budget import budgeted_executor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:  # not Linux; the peak so far is the best we have
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class IngestionService:
+    """
+    Builds the corpus index from the PDFs in a data directory.
+
+    At startup the first worker to take the index lock builds and saves the
+    index if the snapshot on disk is missing or stale, and every other worker
+    loads the saved one: into its own memory in standalone mode, mapped
+    read-only in shared mode (SERVING_MODE=shared). The same build can be run
+    ahead of time with `python -m app.services.ingestion_service`.
+
+    Every build produces a new index snapshot version. `start_rebuild` builds
+    one in the background while the current version keeps serving, and
+    `rollback` reactivates an earlier one. The other workers pick up a new
+    CURRENT version through `watch_snapshots`.
+    """
+
+    def __init__(self, document_service: DocumentService, embedding_service: EmbeddingService,
+                 select: Optional[Callable[[str], bool]] = None, fact_service: Optional[FactService] = None):
+        self.document_service = document_service
+        self.embedding_service = embedding_service
+        self.fact_service = fact_service
+        # Restricts the corpus to some of the PDFs, e.g. one shard's partition.
+        self.select = select
+        self._build_lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.last_rebuild: Dict = {}
+
+    def list_documents(self, data_dir: str) -> List[str]:
+        paths = sorted(os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith(".pdf"))
+        return [path for path in paths if self.select is None or self.select(path)]
+
+    @staticmethod
+    def corpus_fingerprint(paths: List[str]) -> Dict[str, str]:
+        """file name -> SHA-256 of its bytes"""
+        fingerprint = {}
+        for path in paths:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            fingerprint[os.path.basename(path)] = digest.hexdigest()
+        return fingerprint
+
+    @asynccontextmanager
+    async def _exclusive_build(self):
+        """One build at a time in this process, and across workers via the index lock file."""
+        async with self._build_lock:
+            os.makedirs(os.path.dirname(settings.FAISS_INDEX_PATH) or ".", exist_ok=True)
+            with open(f"{settings.FAISS_INDEX_PATH}.lock", "a") as lock_file:
+                # Blocks while another worker is building; run off the loop.
+                await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _prepare(self, text: str, content_hash: str) -> List[str]:
+        """Chunk one document's text and index its facts for the fast path; runs on a worker thread."""
+        chunks = self.document_service.chunk_text(sanitize_text(text), chunk_size=500, overlap=50)
+        if self.fact_service is not None and settings.FACT_FAST_PATH:
+            self.fact_service.index_document(content_hash, text)
+        return chunks
+
+    async def _extract(self, file_path: str) -> Optional[Tuple[List[str], str]]:
+        filename = os.path.basename(file_path)
+        try:
+            # Goes through the text cache, so the first request for the document skips extraction.
+            text, content_hash = await self.document_service.process_document_from_local_path(file_path)
+            if not text:
+                return None
+            chunks = await asyncio.to_thread(self._prepare, text, content_hash)
+            logger.info(f"Processed {filename}, created {len(chunks)} chunks.")
+            return chunks, content_hash
+        except Exception as e:
+            logger.error(f"Failed to process {filename}: {e}")
+            return None
+
+    async def _extracted_documents(self, paths: List[str]) -> AsyncIterator[Tuple[List[str], str]]:
+        """
+        (chunks, content hash) of each document, in file order. Up to
+        BUILD_PREFETCH_DOCUMENTS are extracted in parallel ahead of the
+        consumer; above BUILD_MEMORY_LIMIT_MB no new one is started until the
+        consumer has drained those already extracted.
+        """
+        limit = settings.BUILD_MEMORY_LIMIT_MB * 1024 * 1024
+        pending = deque()
+        remaining = iter(paths)
+        warned = False
+        try:
+            while True:
+                while len(pending) < max(1, settings.BUILD_PREFETCH_DOCUMENTS):
+                    if limit and _rss_bytes() > limit:
+                        if pending:
+                            break
+                        if not warned:
+                            # Nothing left to drain: the model and index alone are over the limit.
+                            logger.warning(f"Index build is at {_rss_bytes() >> 20} MB, above BUILD_MEMORY_LIMIT_MB; "
+                                           f"continuing one document at a time")
+                            warned = True
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    pending.append(asyncio.create_task(self._extract(path)))
+                if not pending:
+                    return
+                result = await pending.popleft()
+                if result is not None:
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def build_from_directory(self, data_dir: str = DEFAULT_DATA_DIR) -> int:
+        """
+        Extract, chunk and index every PDF in data_dir as a new snapshot version.
+        Returns the number of chunks indexed.
+
+        Documents stream through the build: they are extracted in parallel,
+        their chunks are encoded in batches of BUILD_BATCH_SIZE while the next
+        documents are extracted, and each batch goes straight into the index
+        and the on-disk chunk store. Only the index vectors grow with the
+        corpus; chunk texts and embeddings are held one batch at a time.
+        """
+        pdf_files = self.list_documents(data_dir)
+        # Hashes every PDF; keep it off the event loop while serving (admin rebuilds).
+        fingerprint = await asyncio.to_thread(self.corpus_fingerprint, pdf_files)
+        if not pdf_files:
+            logger.warning(f"No PDF files found in {data_dir}. The Q&A service will have no knowledge.")
+            return 0
+
+        logger.info(f"Found {len(pdf_files)} documents to process.")
+        started = time.perf_counter()
+        writer = await asyncio.to_thread(self.embedding_service.begin_build)
+        content_hashes = []
+        batch: List[str] = []
+        batch_size = settings.BUILD_BATCH_SIZE
+        peak = _rss_bytes()
+        try:
+            async for chunks, content_hash in self._extracted_documents(pdf_files):
+                content_hashes.append(content_hash)
+                batch.extend(chunks)
+                while len(batch) >= batch_size:
+                    await asyncio.to_thread(self.embedding_service.add_to_build, writer, batch[:batch_size])
+                    del batch[:batch_size]
+                    peak = max(peak, _rss_bytes())
+            if batch:
+                await asyncio.to_thread(self.embedding_service.add_to_build, writer, batch)
+        except BaseException:
+            writer.discard()
+            raise
+
+        count = len(writer)
+        if not count:
+            writer.discard()
+            logger.warning("No text chunks were generated. The index remains empty.")
+            return 0
+        logger.info(f"Encoded {count} chunks from {len(content_hashes)} documents in "
+                    f"{time.perf_counter() - started:.1f}s (peak RSS {peak >> 20} MB); saving the FAISS index...")
+        version = await asyncio.to_thread(
+            self.embedding_service.finish_build, writer, content_hashes, {"corpus": fingerprint}
+        )
+        logger.info(f"FAISS index built successfully as version {version}.")
+        return count
+
+    async def build(self, data_dir: str = DEFAULT_DATA_DIR) -> int:
+        """
+        build_from_directory under the index lock, whether or not CURRENT is
+        up to date (admin rebuilds, the offline build). Workers that build at
+        the same time would otherwise prune each other's new versions before
+        they are loaded.
+        """
+        async with self._exclusive_build():
+            return await self.build_from_directory(data_dir)
+
+    def _is_current(self, fingerprint: Dict[str, str]) -> bool:
+        """Whether CURRENT on disk was built from this corpus with this model."""
+        metadata = self.embedding_service.read_metadata()
+        return bool(metadata) and metadata.get("corpus") == fingerprint \
+            and metadata.get("model", settings.EMBEDDING_MODEL) == settings.EMBEDDING_MODEL
+
+    async def ensure_index(self, data_dir: str = DEFAULT_DATA_DIR) -> None:
+        """
+        Serve the CURRENT snapshot if it is up to date with data_dir, otherwise
+        build a new one. The first worker to take the index lock builds; the
+        workers waiting on it then find the fresh version and load it (mapped
+        read-only in shared mode) instead of re-encoding the corpus.
+        """
+        async with self._exclusive_build():
+            fingerprint = await asyncio.to_thread(self.corpus_fingerprint, self.list_documents(data_dir))
+            if self._is_current(fingerprint):
+                current = SnapshotStore.current_version()
+                if self.embedding_service.version != current:
+                    await asyncio.to_thread(self.embedding_service.load_index)
+                if self.embedding_service.version == current:
+                    logger.info(f"Index snapshot {current} is up to date with {data_dir}; serving it.")
+                    return
+                logger.warning(f"Index snapshot {current} could not be loaded; rebuilding it in this worker.")
+            else:
+                logger.info("Index snapshot missing or stale; building it in this worker.")
+            # finish_build saves the new version and swaps it in.
+            await self.build_from_directory(data_dir)
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild_task is not None and not self._rebuild_task.done()
+
+    def start_rebuild(self, data_dir: str = DEFAULT_DATA_DIR) -> bool:
+        """Start a background rebuild. Returns False if one is already running."""
+        if self.rebuilding:
+            return False
+        self._rebuild_task = asyncio.create_task(self._rebuild(data_dir))
+        return True
+
+    async def _rebuild(self, data_dir: str) -> None:
+        started = time.time()
+        self.last_rebuild = {"status": "running", "started_at": started}
+        try:
+            chunks = await self.build(data_dir)
+            self.last_rebuild = {
+                "status": "succeeded", "started_at": started, "finished_at": time.time(),
+                "version": self.embedding_service.version, "chunks": chunks,
+            }
+        except Exception as e:
+            logger.error(f"Index rebuild failed; still serving {self.embedding_service.version}: {e}")
+            self.last_rebuild = {"status": "failed", "started_at": started, "finished_at": time.time(), "error": str(e)}
+
+    def rollback_target(self) -> Optional[str]:
+        """The version built before the active one, if it is still on disk."""
+        versions = SnapshotStore.versions()
+        previous = (self.embedding_service.snapshot.manifest or {}).get("previous")
+        if previous in versions:
+            return previous
+        current = self.embedding_service.version
+        older = [v for v in versions if current is None or v < current]
+        return older[-1] if older else None
+
+    async def rollback(self, version: Optional[str] = None) -> str:
+        """Activate `version`, or the previous one, for every worker. Returns the active version."""
+        target = version or self.rollback_target()
+        if target is None:
+            raise FileNotFoundError("No earlier index snapshot to roll back to")
+        async with self._exclusive_build():
+            await asyncio.to_thread(self.embedding_service.activate, target)
+        logger.info(f"Rolled index back to snapshot {target}")
+        return target
+
+    async def watch_snapshots(self, interval: float = settings.SNAPSHOT_POLL_INTERVAL) -> None:
+        """Follow CURRENT on disk, so a rebuild or rollback in one worker reaches the others."""
+        failed = None
+        while True:
+            await asyncio.sleep(interval)
+            version = SnapshotStore.current_version()
+            if not version or version in (self.embedding_service.version, failed):
+                continue
+            try:
+                await asyncio.to_thread(self.embedding_service.activate, version, False)
+            except Exception as e:
+                failed = version
+                logger.error(f"Failed to switch to index snapshot {version}: {e}")
+
+
+async def _main(data_dir: str) -> None:
+    # The build encodes through asyncio.to_thread.
+    asyncio.get_running_loop().set_default_executor(budgeted_executor(thread_name_prefix="build"))
+    document_service = DocumentService()
+    embedding_service = EmbeddingService(read_only=False)
+    ingestion_service = IngestionService(document_service, embedding_service)
+    try:
+        await ingestion_service.build(data_dir)
+    finally:
+        await document_service.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.utils.helpers import setup_logging
+    from app.utils.thread_budget import apply_thread_budget
+
+    parser = argparse.ArgumentParser(description="Build the shared FAISS index and chunk store.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    args = parser.parse_args()
+
+    setup_logging()
+    apply_thread_budget(encoders=1)
+    asyncio.run(_main(args.data_dir))
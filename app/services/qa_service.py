@@ -1,40 +1,71 @@
 import google.generativeai as genai
-from typing import List
+from typing import List, Optional
 import logging
 from app.config import settings
 from app.services.clause_matcher import ClauseMatcher
+from app.services.fact_service import FactService
 from app.models.schemas import ClauseMatch
+from app.utils.executor import TrackedExecutor
+from app.utils.metrics import stage
+from app.utils.singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 class QAService:
-    def __init__(self, clause_matcher: ClauseMatcher):
+    def __init__(self, clause_matcher: ClauseMatcher, fact_service: Optional[FactService] = None):
         self.clause_matcher = clause_matcher
+        self.fact_service = fact_service
         if not settings.GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY not found in settings.")
         genai.configure(api_key=settings.GOOGLE_API_KEY)
         self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Identical questions about the same document asked concurrently share one answer.
+        self._inflight = SingleFlight("question")
+        # Query encoding and search are CPU work; keep them off the event loop.
+        self.executor = TrackedExecutor("retrieval", settings.RETRIEVAL_WORKERS)
 
-    async def answer_questions(self, questions: List[str], document_content: str) -> List[str]:
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        return " ".join(question.lower().split()).rstrip("?.! ")
+
+    async def answer_questions(self, questions: List[str], document_content: str,
+                               document_hash: Optional[str] = None) -> List[str]:
         answers = []
+        if settings.FACT_FAST_PATH and self.fact_service is not None and document_hash \
+                and not self.fact_service.has(document_hash):
+            # Documents not seen at ingestion (e.g. another worker built the index).
+            await self.executor.run(self.fact_service.index_document, document_hash, document_content)
         for question in questions:
             try:
-                answer = await self._answer_single_question(question, document_content)
+                answer = self._answer_from_facts(question, document_hash)
+                if answer is not None:
+                    answers.append(answer)
+                    continue
+                if document_hash:
+                    answer = await self._inflight.do(
+                        (document_hash, self._normalize_question(question)),
+                        lambda question=question: self._answer_single_question(question, document_content),
+                    )
+                else:
+                    answer = await self._answer_single_question(question, document_content)
                 answers.append(answer)
             except Exception as e:
                 logger.error(f"Failed to answer question '{question}': {e}")
                 answers.append(f"Unable to answer: {str(e)}")
         return answers
 
+    def _answer_from_facts(self, question: str, document_hash: Optional[str]) -> Optional[str]:
+        if self.fact_service is None or not document_hash or not settings.FACT_FAST_PATH:
+            return None
+        with stage("qa.facts"):
+            return self.fact_service.answer(question, document_hash, self._extract_key_information(question))
+
     async def _answer_single_question(self, question: str, document_content: str) -> str:
         try:
-            relevant_clauses = self.clause_matcher.extract_relevant_clauses(document_content, question)
-            ranked_clauses = self.clause_matcher.rank_clauses_by_relevance(relevant_clauses, question)
-            top_clauses = [c for c in ranked_clauses if c.similarity_score >= 0.6][:5]
-            context = self._build_context(top_clauses)
+            with stage("qa.retrieve"):
+                context = await self.executor.run(self._retrieve_context, question, document_content)
 
-            logger.info(f"Question: {question}")
-            logger.info(f"Context sent to Gemini:\n{context}")
+            logger.debug("Question: %s\nContext sent to Gemini:\n%s", question, context, extra={"payload": True})
 
             answer = await self._generate_answer(question, context)
             return answer
@@ -42,6 +73,12 @@ class QAService:
             logger.error(f"Failed to answer question: {e}")
             raise
 
+    def _retrieve_context(self, question: str, document_content: str) -> str:
+        relevant_clauses = self.clause_matcher.extract_relevant_clauses(document_content, question)
+        ranked_clauses = self.clause_matcher.rank_clauses_by_relevance(relevant_clauses, question)
+        top_clauses = [c for c in ranked_clauses if c.similarity_score >= 0.6][:5]
+        return self._build_context(top_clauses)
+
     def _build_context(self, clauses: List[ClauseMatch]) -> str:
         if not clauses:
             return "No relevant information found."
@@ -53,7 +90,12 @@ class QAService:
     async def _generate_answer(self, question: str, context: str) -> str:
         try:
             prompt = self._create_prompt(question, context)
-            response = await self.model.generate_content_async(prompt)
+            with stage("qa.llm", prompt_chars=len(prompt)) as span:
+                response = await self.model.generate_content_async(prompt)
+                usage = getattr(response, "usage_metadata", None)
+                # Fall back to the usual ~4 characters per token when the API omits usage.
+                span["prompt_tokens"] = getattr(usage, "prompt_token_count", None) or len(prompt) // 4
+                span["output_tokens"] = getattr(usage, "candidates_token_count", None)
             answer = response.text.strip()
             return answer
         except Exception as e:
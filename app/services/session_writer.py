@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from app.config import settings
+from app.models.database import SessionLocal
+from app.services.db_service import DatabaseService
+from app.utils.helpers import compress_text, sanitize_text
+from app.utils.metrics import SESSION_BATCH_SIZE, SESSION_QUEUE_DEPTH, SESSIONS_DROPPED, stage
+
+logger = logging.getLogger(__name__)
+
+class SessionWriter:
+    """
+    Write-behind queue for documents and Q&A sessions.
+
+    Requests enqueue and return immediately; a single background task drains
+    the queue and writes each batch with multi-row INSERTs in one transaction.
+    A batch is flushed when it reaches `batch_size` sessions or when its oldest
+    session has waited `flush_interval` seconds, which bounds how much is lost
+    if the process dies. When the queue is full, submit() waits up to
+    `enqueue_timeout` and then drops the session rather than stall the caller.
+
+    Document text is passed through by reference and only sanitized and
+    compressed (in a worker thread) for hashes that are not stored yet; ids of
+    known documents are cached so repeat documents cost no content work at all.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        batch_size: int = settings.SESSION_BATCH_SIZE,
+        flush_interval: float = settings.SESSION_FLUSH_INTERVAL,
+        max_queue: int = settings.SESSION_QUEUE_MAX,
+        enqueue_timeout: float = settings.SESSION_ENQUEUE_TIMEOUT,
+        document_cache_size: int = settings.DOCUMENT_ID_CACHE_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.document_cache_size = document_cache_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._document_ids: "OrderedDict[str, int]" = OrderedDict()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, blob_url: str, content_hash: str, content: str,
+                     questions: List[str], answers: List[str]) -> bool:
+        """
+        Queue a session for persistence. Returns False if it had to be dropped.
+        `content` is the raw document text; it is only read if the document is new.
+        """
+        if self._queue is None:
+            SESSIONS_DROPPED.labels("not_started").inc()
+            logger.error("Session writer is not running; dropping Q&A session")
+            return False
+        record = {
+            "blob_url": blob_url,
+            "content_hash": content_hash,
+            "content": content,
+            "questions": questions,
+            "answers": answers,
+        }
+        try:
+            if self.enqueue_timeout > 0:
+                await asyncio.wait_for(self._queue.put(record), self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except (asyncio.TimeoutError, asyncio.QueueFull):
+            SESSIONS_DROPPED.labels("queue_full").inc()
+            logger.warning(f"Session queue full ({self.max_queue}); dropping Q&A session for {content_hash}")
+            return False
+        SESSION_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            record = await self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            SESSION_QUEUE_DEPTH.set(self._queue.qsize())
+            await self._flush(batch)
+            if stopping:
+                break
+        # Drain whatever arrived after the stop marker.
+        leftover = []
+        while not self._queue.empty():
+            record = self._queue.get_nowait()
+            if record is not None:
+                leftover.append(record)
+        for start in range(0, len(leftover), self.batch_size):
+            await self._flush(leftover[start:start + self.batch_size])
+        SESSION_QUEUE_DEPTH.set(0)
+
+    def _remember(self, document_ids: Dict[str, int]) -> None:
+        for content_hash, document_id in document_ids.items():
+            self._document_ids[content_hash] = document_id
+            self._document_ids.move_to_end(content_hash)
+        while len(self._document_ids) > self.document_cache_size:
+            self._document_ids.popitem(last=False)
+
+    @staticmethod
+    def _materialize(records: List[dict]) -> List[dict]:
+        return [
+            {
+                "blob_url": record["blob_url"],
+                "content_hash": record["content_hash"],
+                "content_zlib": compress_text(sanitize_text(record["content"])),
+            }
+            for record in records
+        ]
+
+    async def _resolve_documents(self, db_service: DatabaseService, batch: List[dict]) -> Dict[str, int]:
+        """content_hash -> id for every document in the batch, inserting only unseen ones."""
+        first_seen = {}
+        for record in batch:
+            first_seen.setdefault(record["content_hash"], record)
+        document_ids = {h: self._document_ids[h] for h in first_seen if h in self._document_ids}
+
+        missing = [h for h in first_seen if h not in document_ids]
+        if missing:
+            found = await db_service.get_document_ids(missing)
+            document_ids.update(found)
+            new_records = [first_seen[h] for h in missing if h not in found]
+            if new_records:
+                rows = await asyncio.to_thread(self._materialize, new_records)
+                document_ids.update(await db_service.upsert_documents(rows))
+        return document_ids
+
+    async def _flush(self, batch: List[dict]) -> None:
+        try:
+            with stage("db.flush_sessions", sessions=len(batch)):
+                async with self.session_factory() as db:
+                    db_service = DatabaseService(db)
+                    document_ids = await self._resolve_documents(db_service, batch)
+                    await db_service.create_qa_sessions([
+                        {
+                            "document_id": document_ids[record["content_hash"]],
+                            "questions": record["questions"],
+                            "answers": record["answers"],
+                        }
+                        for record in batch
+                    ])
+                    await db.commit()
+            self._remember(document_ids)
+            SESSION_BATCH_SIZE.observe(len(batch))
+        except Exception as e:
+            SESSIONS_DROPPED.labels("write_failed").inc(len(batch))
+            logger.error(f"Failed to persist batch of {len(batch)} Q&A sessions: {e}")
+
+    async def close(self) -> None:
+        """Flush everything still queued and stop the background task."""
+        if self._task is None:
+            return
+        if self.pending:
+            logger.info(f"Flushing {self.pending} queued Q&A sessions")
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
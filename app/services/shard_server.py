@@ -0,0 +1,304 @@
+"""
+Index shards.
+
+The corpus is partitioned across shard server processes, each of which builds
+(or maps) the snapshot index of its own partition and answers top-k searches
+for query vectors. API workers started with INDEX_SHARDS encode the query once,
+send it to every shard in parallel and merge the results.
+
+    python -m app.services.shard_server --shard 0 --shards 4 --listen /tmp/hackrx-shard-0.sock
+    python -m app.services.shard_server --shard 1 --shards 4 --listen 10.0.0.5:7701
+
+A PDF belongs to shard `hash(key) % shards`, where the key is its file name
+(SHARD_KEY=document) or the three-letter insurer code that starts an IRDAI
+UIN file name (SHARD_KEY=insurer). Each shard keeps its snapshots under
+<FAISS_INDEX_PATH>.shard<i>of<n>.
+
+Wire format (all integers big-endian uint32):
+    request:  k, dim, dim float32 values   (k = dim = 0 asks for shard info)
+    response: length, JSON object with "results" ([text, score] pairs) and
+              the snapshot "version" they came from, or "info", or "error"
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.embedding_server import HEADER, LENGTH, _recv_exactly
+from app.utils.metrics import SHARD_ERRORS, SHARD_SEARCH_DURATION, SHARD_UP
+from app.utils.thread_budget import budgeted_executor
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(path: str, key: str = settings.SHARD_KEY) -> str:
+    name = os.path.basename(path)
+    return name[:3].upper() if key == "insurer" else name
+
+
+def shard_for(path: str, shards: int, key: str = settings.SHARD_KEY) -> int:
+    digest = hashlib.sha1(shard_key(path, key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def _connect(address: str, timeout: float) -> socket.socket:
+    if address.startswith("/") or address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address.removeprefix("unix:"))
+        return sock
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class ShardClient:
+    """
+    Connection to one shard server, with its health as seen by this process.
+    Keeps one persistent connection per calling thread.
+    """
+
+    def __init__(self, address: str, name: str, timeout: float = settings.SHARD_TIMEOUT):
+        self.address = address
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+        self.healthy = True
+        self.last_error: Optional[str] = None
+        self.retry_at = 0.0
+        self.latency_ms: Optional[float] = None  # moving average of successful calls
+        self.info: Dict = {}
+        self.content_hashes: frozenset = frozenset()  # documents in the shard's snapshot
+
+    def _call(self, k: int, vector: Optional[np.ndarray]) -> dict:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = _connect(self.address, self.timeout)
+        try:
+            payload = b"" if vector is None else np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+            dim = 0 if vector is None else vector.shape[-1]
+            sock.sendall(HEADER.pack(k, dim) + payload)
+            (length,) = LENGTH.unpack(_recv_exactly(sock, LENGTH.size))
+            response = json.loads(_recv_exactly(sock, length))
+        except BaseException:
+            # The stream may be out of step now; start afresh next time.
+            sock.close()
+            self._local.sock = None
+            raise
+        if "error" in response:
+            raise RuntimeError(f"Shard {self.name}: {response['error']}")
+        return response
+
+    def _record(self, start: float, error: Optional[Exception]) -> None:
+        if error is None:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            self.latency_ms = elapsed_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * elapsed_ms
+            self.healthy, self.last_error = True, None
+        else:
+            SHARD_ERRORS.labels(self.name).inc()
+            if self.healthy:
+                logger.warning(f"Index shard {self.name} at {self.address} failed: {error}")
+            self.healthy, self.last_error = False, str(error)
+            self.retry_at = time.monotonic() + settings.SHARD_RETRY_INTERVAL
+        SHARD_UP.labels(self.name).set(1 if self.healthy else 0)
+
+    def _set_info(self, info: Dict) -> None:
+        self.content_hashes = frozenset(info.pop("content_hashes", None) or ())
+        self.info = info
+
+    @property
+    def available(self) -> bool:
+        # A failed shard is skipped until its retry time, then tried again.
+        return self.healthy or time.monotonic() >= self.retry_at
+
+    def search(self, query_embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        start = time.perf_counter()
+        try:
+            if not self.info:
+                # First contact (e.g. the shard was down at startup).
+                self._set_info(self._call(0, None)["info"])
+            with SHARD_SEARCH_DURATION.labels(self.name).time():
+                response = self._call(k, query_embedding[0])
+            version = response.get("version")
+            if version is not None and version != self.info.get("version"):
+                # The shard swapped snapshots since its info was fetched.
+                self._set_info(self._call(0, None)["info"])
+        except Exception as e:
+            self._record(start, e)
+            raise
+        self._record(start, None)
+        return [(text, float(score)) for text, score in response["results"]]
+
+    def refresh(self) -> Dict:
+        """Fetch the shard's version, chunk count and documents; never raises."""
+        start = time.perf_counter()
+        try:
+            self._set_info(self._call(0, None)["info"])
+            self._record(start, None)
+        except Exception as e:
+            self._record(start, e)
+        return self.status()
+
+    def status(self) -> Dict:
+        return {
+            "shard": self.name,
+            "address": self.address,
+            "healthy": self.healthy,
+            "latency_ms": None if self.latency_ms is None else round(self.latency_ms, 3),
+            "version": self.info.get("version"),
+            "chunks": self.info.get("chunks"),
+            "last_error": self.last_error,
+        }
+
+
+class ShardSet:
+    """
+    Scatter-gather search over all shards. Shards that fail or time out are
+    left out of the merge (and skipped until SHARD_RETRY_INTERVAL has passed),
+    so one slow shard degrades recall rather than failing the request. A
+    search fails only when no shard answers.
+    """
+
+    def __init__(self, addresses: List[str]):
+        self.clients = [ShardClient(address, str(i)) for i, address in enumerate(addresses)]
+        self._pool = budgeted_executor(len(self.clients) * settings.RETRIEVAL_WORKERS, "shard")
+        self._hashes: Tuple[Tuple, frozenset] = ((), frozenset())
+
+    @property
+    def chunks(self) -> int:
+        return sum(client.info.get("chunks") or 0 for client in self.clients)
+
+    @property
+    def content_hashes(self) -> frozenset:
+        """Documents indexed by any shard that has answered so far."""
+        key = tuple(id(client.content_hashes) for client in self.clients)
+        if self._hashes[0] != key:
+            self._hashes = (key, frozenset().union(*(client.content_hashes for client in self.clients)))
+        return self._hashes[1]
+
+    def refresh(self) -> List[Dict]:
+        return list(self._pool.map(ShardClient.refresh, self.clients))
+
+    def status(self) -> List[Dict]:
+        return [client.status() for client in self.clients]
+
+    def search(self, query_embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        clients = [client for client in self.clients if client.available]
+        futures = [self._pool.submit(client.search, query_embedding, k) for client in clients]
+        results, errors = [], []
+        for future in futures:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                errors.append(e)
+        if len(errors) == len(clients):
+            raise RuntimeError(f"No index shard answered: {errors[0] if errors else 'all shards are marked down'}")
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:k]
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+class ShardServer:
+    def __init__(self, shard: int, shards: int, listen: str):
+        from app.services.document_service import DocumentService
+        from app.services.embedding_service import EmbeddingService
+        from app.services.ingestion_service import IngestionService
+
+        self.shard = shard
+        self.shards = shards
+        self.listen = listen
+        self.document_service = DocumentService()
+        # Maps the saved shard read-only, like a shared-mode API worker.
+        self.embedding_service = EmbeddingService(read_only=True)
+        self.ingestion_service = IngestionService(
+            self.document_service, self.embedding_service,
+            select=lambda path: shard_for(path, shards) == shard,
+        )
+
+    def _info(self) -> Dict:
+        snapshot = self.embedding_service.snapshot
+        return {
+            "shard": self.shard,
+            "shards": self.shards,
+            "version": snapshot.version,
+            "chunks": len(snapshot),
+            # Lets API workers skip embedding URL documents this shard already serves.
+            "content_hashes": sorted(snapshot.content_hashes),
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    k, dim = HEADER.unpack(await reader.readexactly(HEADER.size))
+                except asyncio.IncompleteReadError:
+                    break
+                vector = np.frombuffer(await reader.readexactly(dim * 4), dtype=np.float32) if dim else None
+                try:
+                    if vector is None:
+                        response = {"info": self._info()}
+                    else:
+                        snapshot = self.embedding_service.snapshot
+                        results = await asyncio.to_thread(snapshot.search, vector.reshape(1, dim), k)
+                        response = {"results": results, "version": snapshot.version}
+                except Exception as e:
+                    logger.error(f"Shard {self.shard} search failed: {e}")
+                    response = {"error": str(e)}
+                body = json.dumps(response).encode("utf-8")
+                writer.write(LENGTH.pack(len(body)) + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, data_dir: str) -> None:
+        # Searches run through asyncio.to_thread.
+        asyncio.get_running_loop().set_default_executor(budgeted_executor(thread_name_prefix="search"))
+        await self.document_service.start()
+        try:
+            await self.ingestion_service.ensure_index(data_dir)
+            logger.info(f"Shard {self.shard}/{self.shards} ready with {len(self.embedding_service.snapshot)} chunks")
+            if self.listen.startswith("/") or self.listen.startswith("unix:"):
+                path = self.listen.removeprefix("unix:")
+                if os.path.exists(path):
+                    os.unlink(path)
+                server = await asyncio.start_unix_server(self._handle, path=path)
+            else:
+                host, port = self.listen.rsplit(":", 1)
+                server = await asyncio.start_server(self._handle, host, int(port))
+            logger.info(f"Shard {self.shard} listening on {self.listen}")
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.document_service.close()
+
+
+if __name__ == "__main__":
+    from app.services.ingestion_service import DEFAULT_DATA_DIR
+    from app.utils.helpers import setup_logging
+    from app.utils.thread_budget import apply_thread_budget
+
+    parser = argparse.ArgumentParser(description="Serve one partition of the corpus index.")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--listen", required=True, help="Unix socket path or host:port")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    args = parser.parse_args()
+
+    # Every shard keeps its own snapshots next to the configured index path.
+    settings.FAISS_INDEX_PATH = f"{settings.FAISS_INDEX_PATH}.shard{args.shard}of{args.shards}"
+    setup_logging()
+    apply_thread_budget()
+    asyncio.run(ShardServer(args.shard, args.shards, args.listen).serve(args.data_dir))
@@ -2,12 +2,29 @@
 Utility functions and helpers
 """
 
-from .helpers import setup_logging, timer, validate_blob_url, sanitize_text, truncate_for_token_limit
+from .helpers import (
+    setup_logging, timer, validate_blob_url, sanitize_text, truncate_for_token_limit,
+    compress_text, decompress_text
+)
+from .metrics import stage, begin_request, current_timings, render_metrics
+from .singleflight import SingleFlight
+from .executor import TrackedExecutor
+from .thread_budget import apply_thread_budget, thread_budget_status
 
 __all__ = [
     "setup_logging",
     "timer",
     "validate_blob_url", 
     "sanitize_text",
-    "truncate_for_token_limit"
+    "truncate_for_token_limit",
+    "compress_text",
+    "decompress_text",
+    "stage",
+    "begin_request",
+    "current_timings",
+    "render_metrics",
+    "SingleFlight",
+    "TrackedExecutor",
+    "apply_thread_budget",
+    "thread_budget_status"
 ]
\ No newline at end of file
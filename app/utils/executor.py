@@ -0,0 +1,59 @@
+import asyncio
+import contextvars
+import threading
+from typing import Callable, TypeVar
+
+from app.utils.metrics import EXECUTOR_PENDING
+from app.utils.thread_budget import budgeted_executor
+
+T = TypeVar("T")
+
+
+class TrackedExecutor:
+    """
+    Thread pool that knows how much work is waiting on it, so admission
+    control can see CPU backlog. Calls run with a copy of the caller's context,
+    so stage timings recorded inside them land in the request's breakdown.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = budgeted_executor(max_workers, name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calls submitted and not yet finished (running + queued)."""
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        """Calls waiting for a free thread."""
+        return max(0, self._pending - self.max_workers)
+
+    def _track(self, delta: int) -> None:
+        with self._lock:
+            self._pending += delta
+            EXECUTOR_PENDING.labels(self.name).set(self._pending)
+
+    def _call(self, context: contextvars.Context, fn: Callable[..., T], *args) -> T:
+        try:
+            return context.run(fn, *args)
+        finally:
+            self._track(-1)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        self._track(1)
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, self._call, contextvars.copy_context(), fn, *args)
+        except BaseException:
+            self._track(-1)
+            raise
+        # If the caller is cancelled the call still finishes and untracks itself.
+        return await future
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait)
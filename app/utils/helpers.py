@@ -3,17 +3,12 @@ from functools import wraps
 from typing import Callable, Any
 import time
 import asyncio
+import zlib
 
 def setup_logging():
-    """Setup logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('app.log')
-        ]
-    )
+    """Setup logging configuration (queued, see app.utils.structured_logging)"""
+    from app.utils.structured_logging import configure_logging
+    configure_logging()
 
 def timer(func: Callable) -> Callable:
     """Decorator to measure execution time for both sync and async functions"""
@@ -23,7 +18,7 @@ def timer(func: Callable) -> Callable:
             start_time = time.time()
             result = await func(*args, **kwargs)
             end_time = time.time()
-            logging.info(f"{func.__name__} took {end_time - start_time:.2f} seconds")
+            logging.info("%s took %.2f seconds", func.__name__, end_time - start_time)
             return result
         return async_wrapper
     else:
@@ -32,7 +27,7 @@ def timer(func: Callable) -> Callable:
             start_time = time.time()
             result = func(*args, **kwargs)
             end_time = time.time()
-            logging.info(f"{func.__name__} took {end_time - start_time:.2f} seconds")
+            logging.info("%s took %.2f seconds", func.__name__, end_time - start_time)
             return result
         return sync_wrapper
 
@@ -54,6 +49,14 @@ def sanitize_text(text: str) -> str:
     text = text.replace('\r', '\n')  # normalize line breaks
     return text.strip()
 
+def compress_text(text: str, level: int = 6) -> bytes:
+    """Compress text for storage"""
+    return zlib.compress(text.encode("utf-8"), level)
+
+def decompress_text(data: bytes) -> str:
+    """Inverse of compress_text"""
+    return zlib.decompress(data).decode("utf-8")
+
 def truncate_for_token_limit(text: str, max_chars: int = 8000) -> str:
     """Truncate text to stay within token limits"""
     if len(text) <= max_chars:
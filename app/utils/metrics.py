@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+# Request-scoped state. asyncio tasks and asyncio.to_thread copy the current
+# context, so spans recorded anywhere below a request land in its breakdown.
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000, 1000000)
+
+STAGE_DURATION = Histogram(
+    "hackrx_stage_duration_seconds",
+    "Wall time spent in each processing stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SIZE = Histogram(
+    "hackrx_stage_size",
+    "Amount of work handled per stage invocation (chunks searched, prompt tokens, ...)",
+    ["stage", "measure"],
+    buckets=SIZE_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "hackrx_stage_errors_total",
+    "Stage invocations that raised",
+    ["stage"],
+)
+REQUEST_DURATION = Histogram(
+    "hackrx_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ["method", "path", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+SESSION_QUEUE_DEPTH = Gauge(
+    "hackrx_session_queue_depth",
+    "Q&A sessions waiting in the write-behind queue",
+    multiprocess_mode="livesum",
+)
+SESSION_BATCH_SIZE = Histogram(
+    "hackrx_session_flush_batch_size",
+    "Q&A sessions written per flush",
+    buckets=SIZE_BUCKETS,
+)
+SESSIONS_DROPPED = Counter(
+    "hackrx_sessions_dropped_total",
+    "Q&A sessions not persisted",
+    ["reason"],
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "hackrx_singleflight_calls_total",
+    "Calls through a single-flight group, by whether they ran the work or joined an in-flight call",
+    ["group", "role"],
+)
+EXECUTOR_PENDING = Gauge(
+    "hackrx_executor_pending",
+    "Calls submitted to a worker pool and not yet finished",
+    ["executor"],
+    multiprocess_mode="livesum",
+)
+INFLIGHT_QUESTIONS = Gauge(
+    "hackrx_inflight_questions",
+    "Questions admitted and still being answered",
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTIONS = Counter(
+    "hackrx_admission_rejections_total",
+    "Requests shed by admission control",
+    ["reason"],
+)
+SHARD_SEARCH_DURATION = Histogram(
+    "hackrx_shard_search_duration_seconds",
+    "Round trip of one search against one index shard",
+    ["shard"],
+    buckets=LATENCY_BUCKETS,
+)
+SHARD_ERRORS = Counter(
+    "hackrx_shard_errors_total",
+    "Shard searches that failed or timed out",
+    ["shard"],
+)
+SHARD_UP = Gauge(
+    "hackrx_shard_up",
+    "Whether an index shard answered its last call",
+    ["shard"],
+    multiprocess_mode="min",
+)
+FACT_ANSWERS = Counter(
+    "hackrx_fact_answers_total",
+    "Questions checked against extracted facts, by outcome (answered skips the LLM)",
+    ["outcome"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "hackrx_log_records_dropped_total",
+    "Log records dropped because the logging queue was full",
+)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def begin_request(request_id: Optional[str] = None) -> str:
+    """Bind a request id and an empty stage breakdown to the current context."""
+    request_id = request_id or new_request_id()
+    request_id_var.set(request_id)
+    _stage_timings.set({})
+    return request_id
+
+
+def current_timings() -> Dict[str, float]:
+    """Per-stage totals in milliseconds for the current request."""
+    timings = _stage_timings.get() or {}
+    return {name: round(seconds * 1000.0, 3) for name, seconds in timings.items()}
+
+
+@contextmanager
+def stage(name: str, **sizes: float) -> Iterator[Dict[str, float]]:
+    """
+    Time a block as stage `name`.
+
+    Yields a dict of size measures; callers may add entries (e.g. prompt tokens)
+    once they are known. Durations are exported as Prometheus histograms, added
+    to the request's breakdown and logged at DEBUG with the request id.
+    """
+    measures: Dict[str, float] = dict(sizes)
+    start = time.perf_counter()
+    try:
+        yield measures
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.labels(name).observe(duration)
+        for measure, value in measures.items():
+            if value is not None:
+                STAGE_SIZE.labels(name, measure).observe(value)
+
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + duration
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "stage=%s duration_ms=%.3f request_id=%s %s",
+                name, duration * 1000.0, request_id_var.get(),
+                " ".join(f"{k}={v}" for k, v in measures.items()),
+            )
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Serialize all metrics in the Prometheus text format."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
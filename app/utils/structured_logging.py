@@ -0,0 +1,138 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from app.config import settings
+from app.utils.metrics import LOG_RECORDS_DROPPED, request_id_var
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request id while still on the logging thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Keep only a sample of payload-heavy records (logged with
+    `extra={"payload": True}`, e.g. prompts and retrieved context) and
+    truncate the ones kept, so enabling DEBUG does not flood the log.
+    """
+
+    def __init__(self, rate: float, max_chars: int):
+        super().__init__()
+        self.rate = rate
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "payload", False):
+            return True
+        if random.random() >= self.rate:
+            return False
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            record.msg, record.args = f"{message[:self.max_chars]}... [{len(message)} chars]", None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking or erroring when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message here, but leave formatting (and exc_info) to the listener's handlers.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def log_file_path() -> str:
+    """
+    LOG_FILE for this process. Rotation renames the file, which is not safe
+    when several processes write to it, so with WEB_CONCURRENCY > 1 every
+    worker gets its own file (app.log -> app.<pid>.log).
+    """
+    if not settings.LOG_FILE or settings.WEB_CONCURRENCY <= 1:
+        return settings.LOG_FILE
+    root, ext = os.path.splitext(settings.LOG_FILE)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def configure_logging() -> None:
+    """
+    Route all logging through a queue: the calling thread only stamps and
+    enqueues records, and a background listener thread formats them and
+    writes to stderr and a size-rotated file.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if settings.LOG_FILE:
+        handlers.append(RotatingFileHandler(
+            log_file_path(), maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT, encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(PayloadSampler(settings.LOG_PAYLOAD_SAMPLE_RATE, settings.LOG_PAYLOAD_MAX_CHARS))
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
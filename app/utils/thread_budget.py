@@ -0,0 +1,166 @@
+import fcntl
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pool sizes used when the budget is off and nothing is configured.
+DEFAULT_EXTRACTION_WORKERS = 2
+DEFAULT_RETRIEVAL_WORKERS = 4
+
+_budget: Optional[Dict] = None
+_slot_file = None  # held open for the life of the process to keep the CPU slot
+
+
+def affinity() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return list(range(os.cpu_count() or 1))
+
+
+def available_cpus() -> List[int]:
+    cpus = affinity()
+    return cpus[:settings.CPU_BUDGET] if settings.CPU_BUDGET else cpus
+
+
+def _claim_slot(workers: int) -> Optional[int]:
+    """Take the first free worker slot, so each uvicorn worker gets its own cores."""
+    global _slot_file
+    for slot in range(workers):
+        path = os.path.join(settings.CPU_SLOT_DIR or tempfile.gettempdir(), f"hackrx-cpu-slot-{slot}.lock")
+        handle = open(path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_file = handle
+        return slot
+    return None
+
+
+def _auto(value: Optional[int], default: int) -> int:
+    return value if value is not None else max(1, default)
+
+
+def compute_budget(cpus: int, workers: int, encoders: Optional[int] = None) -> Dict:
+    """
+    Split this process's share of the CPUs between its thread pools.
+
+    Each worker gets cpus / workers cores. Retrieval threads run query
+    encoding and FAISS search, so torch and OpenMP get that share divided by
+    the number of calls that can be encoding at the same time (`encoders`,
+    by default the retrieval threads) rather than all cores each.
+    Explicit settings always win.
+    """
+    per_worker = max(1, cpus // max(1, workers))
+    retrieval = _auto(settings.RETRIEVAL_WORKERS, min(DEFAULT_RETRIEVAL_WORKERS, per_worker))
+    per_call = per_worker // (encoders or retrieval)
+    return {
+        "cpus": cpus,
+        "workers": workers,
+        "cpus_per_worker": per_worker,
+        "retrieval_workers": retrieval,
+        "extraction_workers": _auto(settings.EXTRACTION_WORKERS, per_worker // 2),
+        "torch_threads": _auto(settings.TORCH_THREADS, per_call),
+        "faiss_threads": _auto(settings.FAISS_THREADS, per_call),
+        "tokenizers_parallelism": settings.TOKENIZERS_PARALLELISM,
+    }
+
+
+def apply_thread_budget(encoders: Optional[int] = None) -> Dict:
+    """
+    Size every thread pool in this process from the CPU budget, optionally pin
+    the process to its own cores, and return the effective settings. Must run
+    before the services (and their executors) are created; later calls return
+    the settings applied by the first. Processes that run one large encode at
+    a time (the embedding server, offline builds) pass encoders=1.
+
+    Call it before faiss or torch is imported where possible: the OpenMP
+    runtime reads OMP_NUM_THREADS once, when it loads. Threads that encode or
+    search must also run configure_thread (see budgeted_executor), because
+    omp_set_num_threads only changes the calling thread.
+    """
+    global _budget
+    if _budget is not None:
+        return _budget
+
+    cpus = available_cpus()
+    if settings.THREAD_BUDGET == "off":
+        if settings.RETRIEVAL_WORKERS is None:
+            settings.RETRIEVAL_WORKERS = DEFAULT_RETRIEVAL_WORKERS
+        if settings.EXTRACTION_WORKERS is None:
+            settings.EXTRACTION_WORKERS = DEFAULT_EXTRACTION_WORKERS
+        _budget = {
+            "mode": "off",
+            "cpus": len(cpus),
+            "retrieval_workers": settings.RETRIEVAL_WORKERS,
+            "extraction_workers": settings.EXTRACTION_WORKERS,
+            "pinned_cpus": None,
+        }
+        return _budget
+
+    budget = compute_budget(len(cpus), settings.WEB_CONCURRENCY, encoders)
+    pinned = None
+    if settings.CPU_PINNING:
+        slot = _claim_slot(settings.WEB_CONCURRENCY)
+        if slot is None:
+            logger.warning("No free CPU slot; running unpinned")
+        else:
+            per_worker = budget["cpus_per_worker"]
+            pinned = cpus[slot * per_worker:(slot + 1) * per_worker] or cpus
+            os.sched_setaffinity(0, pinned)
+
+    # Pools created from here on read these.
+    settings.RETRIEVAL_WORKERS = budget["retrieval_workers"]
+    settings.EXTRACTION_WORKERS = budget["extraction_workers"]
+
+    # Read by OpenMP/MKL/OpenBLAS when they load; too late if they already have.
+    threads = str(budget["torch_threads"])
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "true" if budget["tokenizers_parallelism"] else "false"
+
+    budget.update({"mode": "auto", "pinned_cpus": pinned})
+    _budget = budget
+    configure_thread()
+    try:
+        import torch
+        budget["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        budget["torch_threads"] = None  # model served elsewhere (EMBEDDING_SOCKET)
+    logger.info(f"Thread budget: {budget}")
+    return _budget
+
+
+def configure_thread() -> None:
+    """Apply the torch and FAISS thread counts to the calling thread (OpenMP settings are per thread)."""
+    if _budget is None or _budget["mode"] != "auto":
+        return
+    try:
+        import torch
+        torch.set_num_threads(_budget["torch_threads"])
+    except ImportError:
+        pass
+    try:
+        import faiss
+        faiss.omp_set_num_threads(_budget["faiss_threads"])
+    except (ImportError, AttributeError):  # CPU wheels built without OpenMP
+        pass
+
+
+def budgeted_executor(max_workers: Optional[int] = None, thread_name_prefix: str = "") -> ThreadPoolExecutor:
+    """A thread pool whose threads run encodes and searches within the budget."""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix,
+                              initializer=configure_thread)
+
+
+def thread_budget_status() -> Dict:
+    """The applied budget plus the CPUs this process may run on right now."""
+    return {**(_budget or {"mode": "unset"}), "affinity": affinity()}
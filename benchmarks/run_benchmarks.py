@@ -0,0 +1,452 @@
+# benchmarks/run_benchmarks.py
+"""
+End-to-end benchmark suite for the ingestion and query paths.
+
+Measures, using the PDFs in app/data/ plus synthetic scale-ups of that corpus:
+  * fetch           - streamed download from a local HTTP stand-in, cold and
+                      conditional (ETag / 304) re-fetches
+  * extraction      - PDF text extraction (pages/s, MB/s)
+  * chunking        - word chunking (chunks/s)
+  * embedding       - SentenceTransformer encoding (chunks/s)
+  * index_build     - FAISS index construction at several corpus sizes
+  * search          - EmbeddingService.search latency percentiles per corpus size
+  * e2e             - POST /hackrx/run throughput/latency under concurrent load,
+                      with the Gemini call replaced by a fixed-latency stub; the app's
+                      own lifespan ingests app/data/, one untimed request per document
+                      warms it up, and a throwaway SQLite database stands in for Postgres
+
+Results are written as JSON so two runs can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# The app reads its configuration at import time, so point it at throwaway
+# state before anything under app/ is imported.
+_WORK_DIR = tempfile.mkdtemp(prefix="hackrx-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_WORK_DIR, 'bench.db')}")
+os.environ.setdefault("FAISS_INDEX_PATH", os.path.join(_WORK_DIR, "faiss_index"))
+os.environ.setdefault("API_TOKEN", "bench-token")
+os.environ.setdefault("GOOGLE_API_KEY", "bench-key")
+
+import numpy as np  # noqa: E402
+
+DATA_DIR = os.path.join(ROOT_DIR, "app", "data")
+
+SAMPLE_QUESTIONS = [
+    "What is the grace period for premium payment?",
+    "What is the waiting period for pre-existing diseases?",
+    "Does this policy cover maternity expenses?",
+    "What is the waiting period for cataract surgery?",
+    "Are medical expenses for an organ donor covered?",
+    "What is the No Claim Discount offered in this policy?",
+    "Is there a benefit for preventive health check-ups?",
+    "How does the policy define a Hospital?",
+    "What is the extent of coverage for AYUSH treatments?",
+    "Are there any sub-limits on room rent and ICU charges?",
+]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarise latency samples (seconds) as milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        idx = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+        return ordered[idx] * 1000.0
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000.0,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": ordered[-1] * 1000.0,
+    }
+
+
+def timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_extraction(document_service, pdf_paths: List[str]) -> Dict:
+    from PyPDF2 import PdfReader
+    from io import BytesIO
+
+    total_pages = 0
+    total_bytes = 0
+    total_seconds = 0.0
+    texts = {}
+    per_document = {}
+    for path in pdf_paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        pages = len(PdfReader(BytesIO(content)).pages)
+        text, seconds = timed(document_service._extract_text_from_pdf, content)
+        texts[os.path.basename(path)] = text
+        total_pages += pages
+        total_bytes += len(content)
+        total_seconds += seconds
+        per_document[os.path.basename(path)] = {
+            "pages": pages,
+            "bytes": len(content),
+            "seconds": seconds,
+            "pages_per_s": pages / seconds if seconds else 0.0,
+        }
+    return {
+        "documents": len(pdf_paths),
+        "pages": total_pages,
+        "seconds": total_seconds,
+        "pages_per_s": total_pages / total_seconds if total_seconds else 0.0,
+        "mb_per_s": (total_bytes / 1e6) / total_seconds if total_seconds else 0.0,
+        "per_document": per_document,
+        "_texts": texts,
+    }
+
+
+async def bench_fetch(pdf_paths: List[str], rounds: int) -> Dict:
+    from aiohttp import web
+    from app.services.document_service import DocumentService
+
+    data_dir = os.path.dirname(pdf_paths[0])
+    server = web.Application()
+    server.router.add_static("/docs", data_dir)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    urls = [f"http://127.0.0.1:{port}/docs/{os.path.basename(p)}" for p in pdf_paths]
+
+    service = DocumentService()
+    await service.start()
+    cold, conditional = [], []
+    total_bytes = 0
+    try:
+        for _ in range(rounds):
+            for url in urls:
+                start = time.perf_counter()
+                spool, _, _, size = await service.fetch_document(url, conditional=False)
+                cold.append(time.perf_counter() - start)
+                total_bytes += size
+                spool.close()
+
+                start = time.perf_counter()
+                spool, _, _, _ = await service.fetch_document(url)
+                conditional.append(time.perf_counter() - start)
+                if spool is not None:
+                    spool.close()
+    finally:
+        await service.close()
+        await runner.cleanup()
+    return {
+        "mb_per_s": (total_bytes / 1e6) / sum(cold) if cold else 0.0,
+        "cold": percentiles(cold),
+        "conditional": percentiles(conditional),
+    }
+
+
+def bench_chunking(document_service, texts: Dict[str, str]) -> Dict:
+    from app.utils.helpers import sanitize_text
+
+    chunks: List[str] = []
+    start = time.perf_counter()
+    for text in texts.values():
+        chunks.extend(document_service.chunk_text(sanitize_text(text), chunk_size=500, overlap=50))
+    seconds = time.perf_counter() - start
+    return {
+        "chunks": len(chunks),
+        "seconds": seconds,
+        "chunks_per_s": len(chunks) / seconds if seconds else 0.0,
+        "_chunks": chunks,
+    }
+
+
+def bench_embedding(embedding_service, chunks: List[str]) -> Dict:
+    # Warm up once so model lazy-initialisation is not counted.
+    embedding_service.create_embeddings(chunks[:1])
+    embeddings, seconds = timed(embedding_service.create_embeddings, chunks)
+    return {
+        "chunks": len(chunks),
+        "seconds": seconds,
+        "chunks_per_s": len(chunks) / seconds if seconds else 0.0,
+        "_embeddings": embeddings,
+    }
+
+
+def synthetic_corpus(chunks: List[str], embeddings: np.ndarray, scale: int, seed: int = 0):
+    """Replicate the real corpus `scale` times with jittered vectors so search cost grows realistically."""
+    if scale <= 1:
+        return list(chunks), embeddings.copy()
+    rng = np.random.default_rng(seed)
+    texts = []
+    blocks = []
+    for copy in range(scale):
+        texts.extend(f"{chunk} [replica {copy}]" if copy else chunk for chunk in chunks)
+        noise = rng.normal(0.0, 0.01, size=embeddings.shape).astype("float32") if copy else 0.0
+        blocks.append(embeddings + noise)
+    return texts, np.vstack(blocks).astype("float32")
+
+
+def bench_index_and_search(embedding_service, chunks: List[str], embeddings: np.ndarray,
+                           scales: List[int], queries: int) -> Dict:
+    import faiss
+    from app.services.index_snapshot import IndexSnapshot
+
+    results = {}
+    questions = [SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)] for i in range(queries)]
+    for scale in scales:
+        texts, vectors = synthetic_corpus(chunks, embeddings, scale)
+
+        start = time.perf_counter()
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        faiss.normalize_L2(vectors)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+
+        embedding_service.swap(IndexSnapshot(index, texts))
+
+        embedding_service.search(questions[0], k=10)
+        latencies = []
+        for question in questions:
+            _, seconds = timed(embedding_service.search, question, 10)
+            latencies.append(seconds)
+
+        results[str(len(texts))] = {
+            "scale": scale,
+            "chunks": len(texts),
+            "index_build_seconds": build_seconds,
+            "search": percentiles(latencies),
+        }
+    return results
+
+
+async def bench_e2e(pdf_names: List[str], concurrency_levels: List[int],
+                    requests_per_level: int, questions_per_request: int, llm_latency_ms: float,
+                    log_level: str) -> Dict:
+    import httpx
+    from app import main
+
+    # Importing app.main installs the app's logging config; keep per-request INFO lines out of the timings.
+    logging.getLogger().setLevel(log_level)
+
+    async def stub_generate_answer(question: str, context: str) -> str:
+        await asyncio.sleep(llm_latency_ms / 1000.0)
+        return f"Stubbed answer for: {question}"
+
+    main.qa_service._generate_answer = stub_generate_answer
+
+    headers = {"Authorization": f"Bearer {os.environ['API_TOKEN']}"}
+    questions = [SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)] for i in range(questions_per_request)]
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    # Run the app's own lifespan so startup (DB init, corpus ingestion) and
+    # shutdown (draining background writes) behave as in production.
+    start = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        results["startup_seconds"] = time.perf_counter() - start
+        # One untimed request per document, so the first level doesn't absorb
+        # cold extraction and first-touch costs the later levels never pay.
+        start = time.perf_counter()
+        for name in pdf_names:
+            payload = {"documents": name, "questions": questions}
+            response = await client.post("/hackrx/run", json=payload, headers=headers)
+            if response.status_code != 200:
+                print(f"Warm-up request for {name} returned {response.status_code}")
+        results["warmup_seconds"] = time.perf_counter() - start
+        for concurrency in concurrency_levels:
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies: List[float] = []
+            errors = 0
+
+            async def one_request(i: int):
+                nonlocal errors
+                payload = {"documents": pdf_names[i % len(pdf_names)], "questions": questions}
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/hackrx/run", json=payload, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request(i) for i in range(requests_per_level)))
+            wall = time.perf_counter() - start
+
+            results[str(concurrency)] = {
+                "concurrency": concurrency,
+                "requests": requests_per_level,
+                "errors": errors,
+                "wall_seconds": wall,
+                "requests_per_s": requests_per_level / wall if wall else 0.0,
+                "questions_per_s": requests_per_level * questions_per_request / wall if wall else 0.0,
+                "latency": percentiles(latencies),
+            }
+    return results
+
+
+def strip_private(value):
+    if isinstance(value, dict):
+        return {k: strip_private(v) for k, v in value.items() if not k.startswith("_")}
+    return value
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = float(value)
+    return flat
+
+
+# Metrics where a larger number is an improvement; everything else (seconds, ms) is lower-is-better.
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Print a side-by-side comparison and return the metrics that regressed beyond `threshold`."""
+    now = flatten(current["results"])
+    before = flatten(baseline["results"])
+    regressions = []
+    print(f"\n{'metric':70s} {'baseline':>12s} {'current':>12s} {'change':>9s}")
+    for key in sorted(set(now) & set(before)):
+        if key.endswith((".count", ".chunks", ".pages", ".documents", ".requests", ".concurrency", ".scale", ".bytes")):
+            continue
+        old, new = before[key], now[key]
+        change = (new - old) / old if old else 0.0
+        print(f"{key:70s} {old:12.3f} {new:12.3f} {change:+8.1%}")
+        worse = change < -threshold if key.endswith(HIGHER_IS_BETTER) else change > threshold
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion and query paths.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory of PDFs to benchmark with")
+    parser.add_argument("--scales", default="1,4,16", help="Synthetic corpus multipliers for index/search")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries per corpus size")
+    parser.add_argument("--concurrency", default="1,8,32", help="Concurrent clients for the e2e run")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--questions-per-request", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Latency of the stubbed LLM call")
+    parser.add_argument("--log-level", default="WARNING", help="Root log level while benchmarking")
+    parser.add_argument("--skip-e2e", action="store_true", help="Only run the component benchmarks")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=None, help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    from app.utils.thread_budget import apply_thread_budget
+
+    # Same sizing as the server, applied before faiss/torch load; compare a
+    # THREAD_BUDGET=auto run against the default (off) as the baseline.
+    thread_budget = apply_thread_budget()
+
+    from app.services.document_service import DocumentService
+    from app.services.embedding_service import EmbeddingService
+
+    pdf_paths = sorted(
+        os.path.join(args.data_dir, f) for f in os.listdir(args.data_dir) if f.endswith(".pdf")
+    )
+    if not pdf_paths:
+        print(f"No PDF files found in {args.data_dir}")
+        return 1
+
+    document_service = DocumentService()
+    embedding_service = EmbeddingService()
+
+    results: Dict[str, Dict] = {}
+    print("Fetching documents from a local HTTP server...")
+    results["fetch"] = asyncio.run(bench_fetch(pdf_paths, rounds=3))
+    print(f"Extracting {len(pdf_paths)} documents...")
+    results["extraction"] = bench_extraction(document_service, pdf_paths)
+    print("Chunking...")
+    results["chunking"] = bench_chunking(document_service, results["extraction"]["_texts"])
+    chunks = results["chunking"]["_chunks"]
+    print(f"Embedding {len(chunks)} chunks...")
+    results["embedding"] = bench_embedding(embedding_service, chunks)
+    print("Building indexes and measuring search latency...")
+    results["index_search"] = bench_index_and_search(
+        embedding_service, chunks, results["embedding"]["_embeddings"],
+        parse_int_list(args.scales), args.queries,
+    )
+    if not args.skip_e2e:
+        print("Running end-to-end load against /hackrx/run...")
+        results["e2e"] = asyncio.run(bench_e2e(
+            [os.path.basename(p) for p in pdf_paths], parse_int_list(args.concurrency),
+            args.requests, args.questions_per_request, args.llm_latency_ms, args.log_level,
+        ))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "thread_budget": thread_budget,
+            "args": vars(args),
+        },
+        "results": strip_private(results),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nthread budget: baseline {baseline['meta'].get('thread_budget')}, current {thread_budget}")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}:")
+            for key in regressions:
+                print(f"  - {key}")
+            return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,9 +14,13 @@ CREATE TABLE IF NOT EXISTS documents (
     content_hash VARCHAR(64) UNIQUE NOT NULL,
     processed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     content TEXT,
+    content_zlib BYTEA,
     CONSTRAINT unique_content_hash UNIQUE (content_hash)
 );
 
+-- Document text is stored zlib-compressed in content_zlib; content is kept for older rows
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_zlib BYTEA;
+
 -- Create index on content_hash for faster lookups
 CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash);
 CREATE INDEX IF NOT EXISTS idx_documents_url ON documents(blob_url);
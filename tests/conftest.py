@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# The app reads its configuration at import time, so point it at throwaway
+# state before anything under app/ is imported.
+_WORK_DIR = tempfile.mkdtemp(prefix="hackrx-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_WORK_DIR, 'tests.db')}")
+os.environ.setdefault("FAISS_INDEX_PATH", os.path.join(_WORK_DIR, "faiss_index"))
+os.environ.setdefault("API_TOKEN", "test-token")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
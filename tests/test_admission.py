@@ -0,0 +1,179 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+import pytest
+
+from app.config import settings
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+class FakeExecutor:
+    """Stands in for TrackedExecutor: admission only reads `name` and `queued`."""
+
+    def __init__(self, name: str, queued: int = 0):
+        self.name = name
+        self.queued = queued
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_INFLIGHT_QUESTIONS", 20)
+    monkeypatch.setattr(settings, "MAX_INFLIGHT_QUESTIONS_PER_TOKEN", 10)
+    monkeypatch.setattr(settings, "MAX_EXECUTOR_QUEUE", 4)
+    monkeypatch.setattr(settings, "SMALL_REQUEST_QUESTIONS", 3)
+    monkeypatch.setattr(settings, "SMALL_REQUEST_RESERVE", 0.25)  # large requests may use 15
+    monkeypatch.setattr(settings, "RETRY_AFTER_MAX", 30)
+
+
+def idle(controller: AdmissionController) -> bool:
+    return controller.inflight == 0 and controller._requests == 0 and not controller._per_token
+
+
+async def hold(stack: AsyncExitStack, controller: AdmissionController, token: str, questions: int) -> None:
+    await stack.enter_async_context(controller.admit(token, questions))
+
+
+async def rejection(controller: AdmissionController, token: str, questions: int) -> AdmissionRejected:
+    with pytest.raises(AdmissionRejected) as info:
+        async with controller.admit(token, questions):
+            pass
+    return info.value
+
+
+def test_capacity_is_released_when_the_request_raises():
+    async def scenario():
+        controller = AdmissionController([])
+        with pytest.raises(RuntimeError):
+            async with controller.admit("a", 5):
+                assert controller.inflight == 5
+                raise RuntimeError("handler failed")
+        assert idle(controller)
+
+        # Cancellation releases it as well.
+        async def request():
+            async with controller.admit("a", 5):
+                await asyncio.Event().wait()
+
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        assert controller.inflight == 5
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert idle(controller)
+
+    asyncio.run(scenario())
+
+
+def test_rejection_leaves_accounting_untouched():
+    async def scenario():
+        controller = AdmissionController([])
+        async with AsyncExitStack() as stack:
+            await hold(stack, controller, "a", 8)
+            assert (await rejection(controller, "a", 3)).reason == "token_quota"
+            assert controller.inflight == 8
+            assert controller._requests == 1
+            assert list(controller._per_token.values()) == [8]
+        assert idle(controller)
+
+    asyncio.run(scenario())
+
+
+def test_per_token_quota():
+    async def scenario():
+        controller = AdmissionController([])
+        async with AsyncExitStack() as stack:
+            await hold(stack, controller, "a", 8)
+            assert (await rejection(controller, "a", 3)).reason == "token_quota"
+            await hold(stack, controller, "a", 2)  # exactly at the quota
+            await hold(stack, controller, "b", 3)  # other tokens are unaffected
+            assert controller.inflight == 13
+        assert idle(controller)
+
+    asyncio.run(scenario())
+
+
+def test_small_requests_keep_a_reserve():
+    async def scenario():
+        controller = AdmissionController([])
+        async with AsyncExitStack() as stack:
+            await hold(stack, controller, "a", 10)
+            await hold(stack, controller, "b", 4)
+            # A large request may only fill 15 of the 20 questions...
+            assert (await rejection(controller, "c", 4)).reason == "capacity"
+            # ...while small ones can still use the rest.
+            await hold(stack, controller, "c", 3)
+            await hold(stack, controller, "d", 3)
+            assert controller.inflight == 20
+            assert (await rejection(controller, "e", 1)).reason == "capacity"
+        assert idle(controller)
+
+    asyncio.run(scenario())
+
+
+def test_oversize_request_is_admitted_only_alone():
+    async def scenario():
+        controller = AdmissionController([])
+        async with AsyncExitStack() as stack:
+            # Larger than both the token quota and the global capacity, but nothing else is running.
+            await hold(stack, controller, "a", 50)
+            assert (await rejection(controller, "a", 1)).reason == "token_quota"
+            assert (await rejection(controller, "b", 1)).reason == "capacity"
+        assert idle(controller)
+
+        async with AsyncExitStack() as stack:
+            await hold(stack, controller, "b", 1)
+            assert (await rejection(controller, "a", 50)).reason == "capacity"
+
+    asyncio.run(scenario())
+
+
+def test_executor_backlog_sheds_requests():
+    async def scenario():
+        retrieval = FakeExecutor("retrieval")
+        controller = AdmissionController([FakeExecutor("extraction"), retrieval])
+        async with controller.admit("a", 1):
+            pass
+        retrieval.queued = settings.MAX_EXECUTOR_QUEUE  # at the limit is still fine
+        async with controller.admit("a", 1):
+            pass
+        retrieval.queued = settings.MAX_EXECUTOR_QUEUE + 1
+        assert (await rejection(controller, "a", 1)).reason == "retrieval_queue"
+        assert idle(controller)
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_bounds():
+    async def scenario():
+        controller = AdmissionController([])
+        async with AsyncExitStack() as stack:
+            await hold(stack, controller, "a", 10)
+
+            controller._seconds_per_question = 0.001
+            assert (await rejection(controller, "a", 1)).retry_after == 1
+
+            controller._seconds_per_question = 2.0
+            # One request in flight must finish its 1 excess question: one wave.
+            assert (await rejection(controller, "a", 1)).retry_after == 2
+            # Four excess questions against a single running request: four waves.
+            assert (await rejection(controller, "a", 4)).retry_after == 8
+
+            controller._seconds_per_question = 1000.0
+            assert (await rejection(controller, "a", 1)).retry_after == settings.RETRY_AFTER_MAX
+
+        retrieval = FakeExecutor("retrieval", queued=settings.MAX_EXECUTOR_QUEUE + 1)
+        controller = AdmissionController([retrieval])
+        assert 1 <= (await rejection(controller, "a", 1)).retry_after <= settings.RETRY_AFTER_MAX
+
+    asyncio.run(scenario())
+
+
+def test_seconds_per_question_tracks_completed_requests():
+    async def scenario():
+        controller = AdmissionController([])
+        async with controller.admit("a", 4):
+            pass
+        # Instant requests pull the moving average down from its 2s starting point.
+        assert controller._seconds_per_question < 2.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.models.database import Base, Document, QASession
+from app.services.session_writer import SessionWriter
+
+
+class RecordingWriter(SessionWriter):
+    """Records the size of every flushed batch; flushes wait for `gate` when it is set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+        self.gate = None
+
+    async def _flush(self, batch):
+        if self.gate is not None:
+            await self.gate.wait()
+        await super()._flush(batch)
+        self.batches.append(len(batch))
+
+
+@pytest.fixture
+def database(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'sessions.db'}")
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    asyncio.run(engine.dispose())
+
+
+async def count(session_factory, model) -> int:
+    async with session_factory() as db:
+        return (await db.execute(select(func.count()).select_from(model))).scalar_one()
+
+
+async def wait_for_rows(session_factory, model, expected: int, timeout: float = 2.0) -> int:
+    deadline = time.monotonic() + timeout
+    while True:
+        rows = await count(session_factory, model)
+        if rows >= expected or time.monotonic() > deadline:
+            return rows
+        await asyncio.sleep(0.01)
+
+
+def submit(writer, content_hash: str, content="policy text"):
+    return writer.submit(f"http://docs/{content_hash}.pdf", content_hash, content, ["q"], ["a"])
+
+
+def test_flushes_when_batch_is_full(database):
+    async def scenario():
+        writer = RecordingWriter(database, batch_size=3, flush_interval=60, max_queue=100)
+        await writer.start()
+        for i in range(3):
+            assert await submit(writer, "doc")
+        # Nowhere near the flush interval, so only the batch size can have triggered this.
+        assert await wait_for_rows(database, QASession, 3) == 3
+        assert writer.batches == [3]
+        await writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_flushes_partial_batch_after_interval(database):
+    async def scenario():
+        writer = RecordingWriter(database, batch_size=100, flush_interval=0.05, max_queue=100)
+        await writer.start()
+        for i in range(2):
+            assert await submit(writer, "doc")
+        assert await wait_for_rows(database, QASession, 2) == 2
+        assert writer.batches == [2]
+        await writer.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("enqueue_timeout", [0, 0.01])
+def test_drops_sessions_when_queue_is_full(database, enqueue_timeout):
+    async def scenario():
+        writer = RecordingWriter(database, batch_size=1, flush_interval=60, max_queue=1,
+                                 enqueue_timeout=enqueue_timeout)
+        writer.gate = asyncio.Event()
+        await writer.start()
+        assert await submit(writer, "a")
+        await asyncio.sleep(0.01)  # the writer takes it and blocks in _flush
+        assert await submit(writer, "b")  # fills the queue
+        assert not await submit(writer, "c")
+        writer.gate.set()
+        await writer.close()
+        assert await count(database, QASession) == 2
+
+    asyncio.run(scenario())
+
+
+def test_close_drains_queued_sessions(database):
+    async def scenario():
+        writer = RecordingWriter(database, batch_size=2, flush_interval=60, max_queue=100)
+        await writer.start()
+        for i in range(5):
+            assert await submit(writer, f"doc{i}")
+        await writer.close()
+        assert await count(database, QASession) == 5
+        assert await count(database, Document) == 5
+        assert sum(writer.batches) == 5 and max(writer.batches) <= 2
+        assert writer.pending == 0
+        # A closed writer refuses new work instead of queueing it forever.
+        assert not await submit(writer, "late")
+
+    asyncio.run(scenario())
+
+
+def test_document_ids_are_cached(database, monkeypatch):
+    materialized = []
+    original = SessionWriter._materialize
+
+    def materialize(records):
+        materialized.extend(record["content_hash"] for record in records)
+        return original(records)
+
+    monkeypatch.setattr(SessionWriter, "_materialize", staticmethod(materialize))
+
+    async def scenario():
+        writer = RecordingWriter(database, batch_size=100, flush_interval=0.01, max_queue=100,
+                                 document_cache_size=2)
+        await writer.start()
+        # Repeats within a batch store the document once.
+        assert await submit(writer, "a")
+        assert await submit(writer, "a")
+        assert await wait_for_rows(database, QASession, 2) == 2
+        assert materialized == ["a"]
+
+        # A cached id means the content is never touched again.
+        assert await submit(writer, "a", content=None)
+        assert await wait_for_rows(database, QASession, 3) == 3
+        assert materialized == ["a"]
+
+        # The cache is bounded and evicts the least recently stored hash.
+        assert await submit(writer, "b")
+        assert await submit(writer, "c")
+        assert await wait_for_rows(database, QASession, 5) == 5
+        assert list(writer._document_ids) == ["b", "c"]
+        await writer.close()
+        assert await count(database, Document) == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.utils.singleflight import SingleFlight
+
+
+def calls(group: str, role: str) -> float:
+    return REGISTRY.get_sample_value("hackrx_singleflight_calls_total", {"group": group, "role": role}) or 0.0
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test-share")
+        runs = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            await release.wait()
+            return "result"
+
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(flight) == 1
+        release.set()
+        assert await asyncio.gather(*waiters) == ["result"] * 3
+        assert runs == 1
+        assert calls("test-share", "leader") == 1
+        assert calls("test-share", "coalesced") == 2
+
+    asyncio.run(scenario())
+
+
+def test_key_is_forgotten_once_the_call_finishes():
+    async def scenario():
+        flight = SingleFlight("test-forget")
+        runs = 0
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            return runs
+
+        assert await flight.do("key", work) == 1
+        assert len(flight) == 0
+        # Nothing is cached: the next call runs the work again.
+        assert await flight.do("key", work) == 2
+        assert calls("test-forget", "leader") == 2
+        assert calls("test-forget", "coalesced") == 0
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight("test-keys")
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        results = await asyncio.gather(flight.do("a", lambda: work("a")), flight.do("b", lambda: work("b")))
+        assert results == ["a", "b"]
+        assert calls("test-keys", "leader") == 2
+
+    asyncio.run(scenario())
+
+
+def test_every_waiter_receives_the_error():
+    async def scenario():
+        flight = SingleFlight("test-error")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise ValueError("boom")
+
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(r, ValueError) and str(r) == "boom" for r in results)
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_one_waiter_keeps_the_shared_work():
+    async def scenario():
+        flight = SingleFlight("test-cancel-one")
+        release = asyncio.Event()
+        cancelled = False
+
+        async def work():
+            nonlocal cancelled
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            return "result"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert len(flight) == 1
+        release.set()
+        assert await second == "result"
+        assert not cancelled
+
+    asyncio.run(scenario())
+
+
+def test_work_is_cancelled_when_the_last_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight("test-cancel-all")
+        started = 0
+        cancelled = asyncio.Event()
+
+        async def work():
+            nonlocal started
+            started += 1
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        # The abandoned call is forgotten at once, so the next caller starts afresh.
+        assert len(flight) == 0
+
+        async def fresh():
+            return "fresh"
+
+        assert await flight.do("key", fresh) == "fresh"
+        assert started == 1
+        assert calls("test-cancel-all", "leader") == 2
+
+    asyncio.run(scenario())
+
+
+def test_late_caller_after_abandonment_does_not_join_the_cancelled_task():
+    async def scenario():
+        flight = SingleFlight("test-late")
+
+        async def slow():
+            await asyncio.Event().wait()
+
+        waiter = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # The cancelled task may not have finished unwinding yet; a new caller
+        # must still get its own execution rather than the cancellation.
+
+        async def fresh():
+            return "fresh"
+
+        assert await flight.do("key", fresh) == "fresh"
+
+    asyncio.run(scenario())